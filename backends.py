@@ -0,0 +1,112 @@
+"""Load display and luminance source backends on demand"""
+import time
+import importlib
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from log import get_logger
+
+LOG = get_logger('backends')
+
+class BackendRegistry:
+    """Map backend names to their classes, importing modules only when used"""
+    BACKENDS = {
+        'ddcutil': ('display_ddcutil', 'DisplayDDCUtil'),
+        'i2c': ('display_i2c', 'DisplayI2C'),
+        'dbus': ('display_dbus', 'DisplayDBus'),
+        'iio-sensor-proxy': ('luminance_dbus', 'LuminanceDBus'),
+        'iio': ('luminance_iio', 'LuminanceIIO'),
+        'manual': ('luminance_manual', 'LuminanceManual'),
+        'mqtt': ('luminance_mqtt', 'LuminanceMQTT'),
+        'broker': ('luminance_broker', 'LuminanceBroker'),
+    }
+    # D-Bus objects are bound to the main loop, these are detected on the calling thread
+    MAIN_THREAD = ('dbus', 'iio-sensor-proxy')
+
+    def __init__(self):
+        self.timings = {}
+        self.late = []
+
+    @staticmethod
+    def parse_list(names):
+        """Split a comma separated list of backend names"""
+        return [name.strip() for name in names.split(',') if name.strip()]
+
+    def load(self, name):
+        """Import the module of a backend and return its class"""
+        module_name, class_name = self.BACKENDS[name]
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        timing = self.timings.setdefault(name, {'import': 0.0, 'detect': 0.0, 'found': 0})
+        timing['import'] += time.perf_counter() - start
+        return getattr(module, class_name)
+
+    def detect(self, name, parameters=None):
+        """Return every object found by a backend, an empty list if it can not be loaded"""
+        try:
+            backend_class = self.load(name)
+        except KeyError:
+            LOG.error('Unknown backend', backend=name)
+            return []
+        except ImportError as exception:
+            LOG.error('Could not load backend', backend=name, error=exception)
+            return []
+
+        start = time.perf_counter()
+        objects = list(backend_class.detect(parameters) or [])
+        self.timings[name]['detect'] += time.perf_counter() - start
+        self.timings[name]['found'] += len(objects)
+        return objects
+
+    def detect_concurrently(self, requests, timeout):
+        """Run detections in parallel and wait for them until the deadline
+
+        Requests are (name, parameters, callback) tuples, the callback receives the list of
+        objects found. Callbacks of detections finishing in time run in the order of the
+        requests, the others are run by poll_late once their detection finishes. Backends in
+        MAIN_THREAD are detected on the calling thread while the others run.
+        """
+        if not bool(requests):
+            return
+        executor = ThreadPoolExecutor(max_workers=len(requests), thread_name_prefix='detect')
+        results = [
+            None if name in self.MAIN_THREAD else executor.submit(self.detect, name, parameters)
+            for name, parameters, _ in requests
+        ]
+        executor.shutdown(wait=False)
+        for index, (name, parameters, _) in enumerate(requests):
+            if name in self.MAIN_THREAD:
+                results[index] = self.detect(name, parameters)
+
+        deadline = time.monotonic() + timeout
+        for result, (_, _, callback) in zip(results, requests):
+            if isinstance(result, list):
+                callback(result)
+                continue
+            try:
+                objects = result.result(timeout=max(deadline - time.monotonic(), 0))
+            except FutureTimeoutError:
+                self.late.append((result, callback))
+                continue
+            callback(objects)
+
+    def poll_late(self):
+        """Run callbacks of late detections that finished, returns whether any did"""
+        finished = [item for item in self.late if item[0].done()]
+        for future, callback in finished:
+            self.late.remove((future, callback))
+            callback(future.result())
+        return bool(finished)
+
+    def is_detecting(self):
+        """Return whether detections are still running"""
+        return bool(self.late)
+
+    def report(self):
+        """Print import and detection times of the backends used"""
+        for name, timing in self.timings.items():
+            LOG.info(
+                'Backend loaded',
+                backend=name,
+                import_ms=f'{timing["import"] * 1000:.1f}',
+                detect_ms=f'{timing["detect"] * 1000:.1f}',
+                found=timing['found'],
+            )
@@ -1,4 +1,14 @@
 """Base classes for sources and targets"""
+import time
+import threading
+from display_writer import DisplayWriter
+from display_state import DisplayState
+from ddc_timing import DDCTiming
+from bus_lock import BusBusy
+from log import get_logger
+
+LOG = get_logger('display')
+
 class ZenDisplayObject:
     """Base class for sources and targets"""
     def __init__(self, name=None, path=None):
@@ -25,6 +35,7 @@ class LuminanceSource(ZenDisplayObject):
     def __init__(self, name=None, path=None):
         super().__init__(name=name, path=path)
         self.__ready = False
+        self.__updated = None
 
     def is_ready(self):
         """Return whether the source is ready to be used"""
@@ -33,25 +44,128 @@ class LuminanceSource(ZenDisplayObject):
     def get_luminance(self):
         """Get luminance from the source"""
 
+    def get_age(self):
+        """Seconds since the last reading, None if unknown"""
+        if self.__updated is None:
+            return None
+        return time.monotonic() - self.__updated
+
     def _set_ready(self, is_ready):
         """Set the ready flag"""
         self.__ready = is_ready
 
+    def _set_updated(self):
+        """Record the time of a new reading"""
+        self.__updated = time.monotonic()
+
 
 class Display(ZenDisplayObject):
     """Base class for displays"""
+    THREADED_WRITES = False
+    profile = None
+    writer = None
+    # Last brightness known without asking the device, None if unknown
+    brightness = None
+
     def get_brightness(self):
         """Get current brightness of the display"""
 
+    def get_target_brightness(self):
+        """Get the brightness the display is being set to or its current brightness"""
+        if self.writer is not None:
+            target = self.writer.get_target()
+            if target is not None:
+                return target
+        return self.get_brightness()
+
+    def get_cached_brightness(self):
+        """Get the brightness being written or last known, without touching the device"""
+        if self.writer is not None:
+            target = self.writer.get_target()
+            if target is not None:
+                return target
+        return self.brightness
+
     def set_brightness(self, brightness):
         """Set brightness of the display"""
-        if brightness == self.get_brightness():
+        if brightness == self.get_target_brightness():
             return
         if brightness > 100 or brightness < 0:
             return
 
-        if self.enabled:
+        if not self.enabled:
+            return
+        if not self.THREADED_WRITES:
             self._set_brightness(brightness)
+            return
+        if self.writer is None:
+            self.writer = DisplayWriter(self._set_brightness, self.name)
+        self.writer.submit(brightness)
 
     def _set_brightness(self, brightness):
         """Set brightness of the underlying device"""
+
+
+class DDCDisplay(Display):
+    """Base class for displays controlled through DDC/CI
+
+    Reads are cached. The brightness last written is restored at startup without reading
+    the display, it is verified in the background when it is first used.
+    """
+    THREADED_WRITES = True
+    READ_ERRORS = ()
+
+    def __init__(self, name=None, path=None):
+        super().__init__(name, path)
+        self.timing = DDCTiming.from_config(name)
+        self.state_lock = threading.Lock()
+        self.brightness = DisplayState().get(name)
+        self.verified = self.brightness is None
+        self.writes = 0
+
+    def _read_brightness(self):
+        """Read the brightness from the display, raise one of READ_ERRORS on failure"""
+        raise NotImplementedError()
+
+    def read_brightness(self):
+        """Read the brightness from the display into the cache
+
+        A write during the read makes its result stale, it is discarded then.
+        """
+        with self.state_lock:
+            writes = self.writes
+        try:
+            brightness = self._read_brightness()
+        except BusBusy:
+            LOG.info('Bus busy, keeping last brightness', display=self.name, bus=self.path)
+            return
+        except self.READ_ERRORS as exception: # pylint: disable=catching-non-exception
+            brightness = None
+            LOG.warning('Brightness read failed', display=self.name, bus=self.path, error=exception)
+
+        with self.state_lock:
+            if self.writes == writes:
+                self.brightness = brightness
+
+    def _brightness_written(self, brightness):
+        """Cache a brightness written to the display and remember it for the next start"""
+        with self.state_lock:
+            self.brightness = brightness
+            self.verified = True
+            self.writes += 1
+        DisplayState().set(self.name, brightness)
+
+    def get_brightness(self):
+        """Return last brightness value"""
+        if not self.enabled:
+            return None
+
+        if self.brightness is None:
+            self.read_brightness()
+        elif not self.verified:
+            self.verified = True
+            threading.Thread(
+                target=self.read_brightness, name=f'verify {self.name}', daemon=True
+            ).start()
+
+        return self.brightness
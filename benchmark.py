@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""Benchmark the control tick and backend I/O against emulated devices
+
+Results are written as JSON. With a baseline, benchmarks slower or allocating more than
+allowed are reported and the exit status is 1.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+from emulate import set_displays, configure
+
+class Benchmark:
+    """Measure wall time, CPU time and memory allocated per call of a function"""
+    def __init__(self, min_time=0.2, repeat=5):
+        self.min_time = min_time
+        self.repeat = repeat
+        self.results = {}
+
+    def _calibrate(self, function):
+        """Number of calls taking at least min_time"""
+        iterations = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                function()
+            if time.perf_counter() - start >= self.min_time or iterations >= 1 << 20:
+                return iterations
+            iterations *= 2
+
+    def run(self, name, function):
+        """Measure function, keeping the fastest of the repeats"""
+        iterations = self._calibrate(function)
+        wall, cpu = ([], [])
+        for _ in range(self.repeat):
+            start_wall, start_cpu = (time.perf_counter(), time.process_time())
+            for _ in range(iterations):
+                function()
+            wall.append((time.perf_counter() - start_wall) / iterations)
+            cpu.append((time.process_time() - start_cpu) / iterations)
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for _ in range(iterations):
+            function()
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        retained = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+        self.results[name] = {
+            'iterations': iterations,
+            'wall_us': round(min(wall) * 1e6, 3),
+            'cpu_us': round(min(cpu) * 1e6, 3),
+            'peak_bytes': peak,
+            'retained_bytes_per_call': round(max(retained, 0) / iterations, 1),
+        }
+        print(f'{name}: {self.results[name]["wall_us"]:.1f} us', file=sys.stderr)
+
+    def skip(self, name, reason):
+        """Record a benchmark that can not run here"""
+        self.results[name] = {'skipped': reason}
+        print(f'{name}: skipped, {reason}', file=sys.stderr)
+
+
+# Bytes per call that caches and histograms may grow by without counting as a leak
+RETAINED_SLACK = 64
+
+def compare(results, baseline, threshold):
+    """Return descriptions of the regressions against the baseline"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None or 'skipped' in result or 'skipped' in previous:
+            continue
+        for metric in ('wall_us', 'cpu_us'):
+            if result[metric] > previous[metric] * (1 + threshold):
+                regressions.append(
+                    f'{name} {metric} {previous[metric]} -> {result[metric]}'
+                )
+        if result['retained_bytes_per_call'] > previous['retained_bytes_per_call'] + RETAINED_SLACK:
+            regressions.append(
+                f'{name} retained_bytes_per_call {previous["retained_bytes_per_call"]} -> '
+                f'{result["retained_bytes_per_call"]}'
+            )
+    return regressions
+
+
+# pylint: disable=import-outside-toplevel
+def _bench_core(benchmark):
+    """Configuration, controller and display fan-out without device I/O"""
+    from zendisplay_config import Config
+    from controller import Controller
+    from displays import DisplayManager
+    from display_profile import DisplayProfile
+    from base_classes import Display
+
+    benchmark.run('config_get', lambda: Config().get('brightness', 'margin'))
+    benchmark.run('config_get_template', lambda: Config().get('display:bench', 'offset'))
+
+    controller = Controller()
+    profile = DisplayProfile('bench')
+    current = profile.apply(controller.calculate_brightness(100.0))
+    benchmark.run(
+        'controller_recommend_unchanged',
+        lambda: controller.recommend_brightness(100.0, current, profile),
+    )
+
+    class NullDisplay(Display):
+        """Display without a device"""
+        def __init__(self, name):
+            super().__init__(name, name)
+            self.brightness = 0
+
+        def get_brightness(self):
+            return self.brightness
+
+        def _set_brightness(self, brightness):
+            self.brightness = brightness
+
+    for count in (1, 2, 4, 8):
+        manager = DisplayManager()
+        for index in range(count):
+            manager.add_display(NullDisplay(f'null-{index}'))
+        values = iter(range(1 << 62))
+        benchmark.run(
+            f'display_manager_set_brightness[displays={count}]',
+            lambda manager=manager, values=values: manager.set_brightness(next(values) % 101),
+        )
+
+
+MAIN_CONTROL_CASES = ((1, 1), (2, 1), (4, 1), (8, 1), (2, 3))
+
+def _bench_main_control(benchmark):
+    """Full control tick, every case in its own process so no threads or subscribers of
+    an earlier case are left running"""
+    for displays, sensors in MAIN_CONTROL_CASES:
+        output = subprocess.run(
+            [
+                sys.executable, os.path.abspath(__file__),
+                '--main-control', f'{displays},{sensors}',
+                '--min-time', str(benchmark.min_time), '--repeat', str(benchmark.repeat),
+            ],
+            stdout=subprocess.PIPE, check=True,
+        ).stdout
+        benchmark.results.update(json.loads(output))
+
+
+def _bench_main_control_case(benchmark, directory, displays, sensors):
+    """Ticks keeping the brightness, then ticks writing a new one to every display"""
+    from emulator_iio import EmulatorIIO
+    from zendisplay_base import ZenDisplay
+    from zendisplay_config import Config
+
+    set_displays(directory, displays)
+    iio = os.path.join(directory, 'iio')
+    # The brightness changes on every step of the trace
+    emulator = EmulatorIIO(iio, {f'emulated-{index}': [100, 400] for index in range(sensors)})
+    Config().set('general', 'iio_path', iio)
+    zendisplay = ZenDisplay()
+    zendisplay.main_control()
+    benchmark.run(
+        f'main_control[displays={displays},sensors={sensors}]', zendisplay.main_control,
+    )
+
+    def write_tick():
+        emulator.step()
+        zendisplay.main_control()
+    benchmark.run(f'main_control_write[displays={displays},sensors={sensors}]', write_tick)
+
+
+def _bench_backends(benchmark, directory):
+    """Read and write paths of each backend against local stand-ins"""
+    from display_ddcutil import DisplayDDCUtil
+    from display_i2c import DisplayI2C
+    from luminance_iio import LuminanceIIO
+    from emulator_iio import EmulatorIIO
+    from emulator_mqtt import EmulatorMQTT
+    from zendisplay_config import Config
+
+    set_displays(directory, 1)
+    display = next(DisplayDDCUtil.detect())
+    benchmark.run('ddcutil_read', display.read_brightness)
+    benchmark.run('ddcutil_write', lambda: display._set_brightness(50)) # pylint: disable=W0212
+
+    # Without the DDC/CI delays only the overhead of the backend is measured
+    DisplayI2C.REPLY_DELAY, DisplayI2C.WRITE_DELAY = (0.0, 0.0)
+    display = next(DisplayI2C.detect())
+    benchmark.run('i2c_read', display.read_brightness)
+    benchmark.run('i2c_write', lambda: display._set_brightness(50)) # pylint: disable=W0212
+
+    EmulatorIIO(os.path.join(directory, 'iio-backend'), {'emulated': [100]})
+    Config().set('general', 'iio_path', os.path.join(directory, 'iio-backend'))
+    sensor = next(LuminanceIIO.detect())
+    benchmark.run('iio_read', sensor.get_luminance)
+
+    try:
+        from luminance_mqtt import LuminanceMQTT
+    except ImportError as exception:
+        benchmark.skip('mqtt_write', str(exception))
+        return
+    broker = EmulatorMQTT()
+    broker.start()
+    Config().set('mqtt', 'host', '127.0.0.1')
+    Config().set('mqtt', 'port', str(broker.port))
+    client = next(LuminanceMQTT.detect(None))
+    client.enable()
+    # The connection is made in the background
+    deadline = time.monotonic() + 5.0
+    while not client.is_ready() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    benchmark.run('mqtt_write', lambda: client._set_brightness(50)) # pylint: disable=W0212
+    client.disable()
+    broker.stop()
+
+
+def _bench_broker(benchmark, directory):
+    """Sessions reading the sensors sampled by the broker from shared memory"""
+    from luminance_broker import LuminanceBroker
+    from sensor_broker import SensorBroker
+    from zendisplay_config import Config
+
+    Config().set('broker', 'path', os.path.join(directory, 'sensors'))
+    broker = SensorBroker()
+    broker.detect()
+    broker.sample()
+    sensor = next(LuminanceBroker.detect())
+    benchmark.run('broker_read', lambda: sensor.is_ready() and sensor.get_luminance())
+    broker.readings.close()
+# pylint: enable=import-outside-toplevel
+
+
+def main():
+    """Run the benchmarks and compare them against a baseline"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', help='write results to this file instead of stdout')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per measurement')
+    parser.add_argument('--repeat', type=int, default=5, help='measurements per benchmark')
+    parser.add_argument('--no-io', action='store_true', help='skip backend I/O benchmarks')
+    parser.add_argument('--main-control', metavar='DISPLAYS,SENSORS',
+                        help='run one main_control case and print its results')
+    args = parser.parse_args()
+
+    benchmark = Benchmark(args.min_time, args.repeat)
+    with tempfile.TemporaryDirectory(prefix='zendisplay-benchmark-') as directory:
+        configure(directory)
+        from zendisplay_config import Config # pylint: disable=import-outside-toplevel
+        Config().set('logging', 'level', 'error')
+        if args.main_control is not None:
+            displays, sensors = (int(value) for value in args.main_control.split(','))
+            _bench_main_control_case(benchmark, directory, displays, sensors)
+            print(json.dumps(benchmark.results))
+            return 0
+        _bench_core(benchmark)
+        _bench_main_control(benchmark)
+        if not args.no_io:
+            _bench_backends(benchmark, directory)
+            _bench_broker(benchmark, directory)
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': benchmark.results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare(benchmark.results, baseline, args.threshold)
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+        return 1 if bool(regressions) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""Learn brightness corrections from user adjustments"""
+import math
+from log import get_logger
+
+LOG = get_logger('curve')
+
+class LearnedCurve:
+    """Running means of user corrections in bins along a logarithmic luminance scale"""
+    BINS = 20
+    MIN_WEIGHT = 0.01
+
+    def __init__(self, decay=0.5):
+        self.decay = decay
+        self.offsets = [0.0] * self.BINS
+        self.weights = [0.0] * self.BINS
+        self.last_sample = None
+
+    def __str__(self):
+        return ','.join(
+            f'{index}:{self.offsets[index]:.2f}:{weight:.3f}'
+            for index, weight in enumerate(self.weights)
+            if weight >= self.MIN_WEIGHT
+        )
+
+    @classmethod
+    def from_string(cls, data, decay=0.5):
+        """Create a curve from its serialized form"""
+        curve = cls(decay)
+        for item in filter(None, data.split(',')):
+            try:
+                index, offset, weight = item.split(':')
+                if int(index) < 0:
+                    raise IndexError(index)
+                curve.offsets[int(index)] = float(offset)
+                curve.weights[int(index)] = float(weight)
+            except (ValueError, IndexError):
+                LOG.warning('Ignoring invalid learned curve entry', entry=item)
+        return curve
+
+    def _position(self, luminance):
+        """Position of the given luminance on the bin scale"""
+        return min(math.log2(1 + max(luminance, 0)), self.BINS - 1)
+
+    def add_sample(self, luminance, correction, amend=False):
+        """Add a correction for the given luminance, older samples in the bin lose weight
+
+        With amend the previous sample is replaced if it was added to the same bin.
+        """
+        index = round(self._position(luminance))
+        if amend and self.last_sample is not None and self.last_sample[0] == index:
+            _, self.offsets[index], self.weights[index] = self.last_sample
+        else:
+            self.last_sample = (index, self.offsets[index], self.weights[index])
+
+        self.weights[index] = self.weights[index] * self.decay + 1
+        self.offsets[index] += (correction - self.offsets[index]) / self.weights[index]
+
+    def offset(self, luminance):
+        """Interpolate the learned correction for the given luminance"""
+        position = self._position(luminance)
+        below, above = (None, None)
+        for index, weight in enumerate(self.weights):
+            if weight < self.MIN_WEIGHT:
+                continue
+            if index <= position:
+                below = index
+            elif above is None:
+                above = index
+
+        if below is None and above is None:
+            return 0.0
+        if above is None:
+            return self.offsets[below]
+        if below is None:
+            return self.offsets[above]
+
+        ratio = (position - below) / (above - below)
+        return self.offsets[below] + ratio * (self.offsets[above] - self.offsets[below])
@@ -0,0 +1,117 @@
+"""Advisory locks keeping processes from interleaving transfers on an I2C bus"""
+import os
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+from zendisplay_config import Config
+from metrics import Metrics
+from log import get_logger
+
+LOG = get_logger('bus_lock')
+
+class BusBusy(Exception):
+    """Raised when the bus stays locked by another process or thread until the timeout"""
+
+
+class BusLock:
+    """flock on a file shared by every process using the bus
+
+    Both backends lock the device file itself, as ddcutil does, so they wait for each other
+    and for ddcutil run by the user. Only users allowed to open the device can hold its
+    lock. With a lock directory configured, lock files in it keyed by the bus number are
+    used instead.
+    """
+    POLL_INTERVAL = 0.005
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path, timeout=0.1, enabled=True):
+        self.path = path
+        self.timeout = timeout
+        self.enabled = enabled
+        self.file_descriptor = None
+        self.thread_lock = threading.Lock()
+        self.counters = {'acquired': 0, 'contended': 0, 'busy': 0}
+
+    @classmethod
+    def for_path(cls, path):
+        """Lock of the given file shared by every user in this process"""
+        with cls._instances_lock:
+            lock = cls._instances.get(path)
+            if lock is None:
+                lock = cls._instances[path] = cls(
+                    path,
+                    Config().get('general', 'bus_lock_timeout'),
+                    Config().get('general', 'bus_locking'),
+                )
+            return lock
+
+    @classmethod
+    def for_bus(cls, bus):
+        """Lock of a bus through its device file, or a lock file in the configured directory"""
+        directory = Config().get('general', 'bus_lock_path')
+        if not bool(directory):
+            return cls.for_path(os.path.join(Config().get('general', 'i2c_path'), f'i2c-{bus}'))
+        return cls.for_path(os.path.join(directory, f'zendisplay-i2c-{bus}.lock'))
+
+    def _open(self):
+        """Open the lock file, readable is enough to lock a file created by another user"""
+        if self.file_descriptor is None:
+            flags = os.O_RDONLY | os.O_NOFOLLOW | os.O_CLOEXEC
+            if not os.path.exists(self.path):
+                flags |= os.O_CREAT
+            self.file_descriptor = os.open(self.path, flags, 0o666)
+        return self.file_descriptor
+
+    def _acquire(self, deadline):
+        """Take the flock, polling until the deadline"""
+        file_descriptor = self._open()
+        contended = False
+        while True:
+            try:
+                fcntl.flock(file_descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if not contended:
+                    contended = True
+                    self.counters['contended'] += 1
+                    Metrics().count('bus_lock_contended_total', path=self.path)
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(self.POLL_INTERVAL)
+
+    @contextmanager
+    def hold(self):
+        """Hold the lock for the block, raise BusBusy if it can not be taken in time"""
+        if self.enabled:
+            try:
+                self._open()
+            except OSError as exception:
+                LOG.warning('Bus locking disabled', path=self.path, error=exception)
+                self.enabled = False
+        if not self.enabled:
+            yield
+            return
+
+        deadline = time.monotonic() + self.timeout
+        if not self.thread_lock.acquire(timeout=self.timeout):
+            self._busy()
+        try:
+            try:
+                self._acquire(deadline)
+            except BlockingIOError:
+                self._busy()
+            self.counters['acquired'] += 1
+            try:
+                yield
+            finally:
+                fcntl.flock(self.file_descriptor, fcntl.LOCK_UN)
+        finally:
+            self.thread_lock.release()
+
+    def _busy(self):
+        """Count and report a bus that stayed locked"""
+        self.counters['busy'] += 1
+        Metrics().count('bus_lock_busy_total', path=self.path)
+        raise BusBusy(f'{self.path} is in use')
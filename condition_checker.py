@@ -1,8 +1,11 @@
 """Run callbacks based on the result of condition evaluation"""
 from typing import Callable
 from zendisplay_config import Config
-from condition_checker_xserver import ConditionCheckerXserver
+from log import get_logger
 
+LOG = get_logger('conditions')
+
+# pylint: disable-next=too-many-instance-attributes
 class ConditionChecker():
     """Handle confition changes"""
     def __init__(
@@ -11,21 +14,39 @@ class ConditionChecker():
         cb_set: Callable[[int], None],
         true_value=100,
         config='max_brightness',
+        cb_override: Callable[[bool], None] = None,
     ):
         self.original_value = 0
         self.previous_condition = False
         self.true_value = true_value
         self.cb_get = cb_get
         self.cb_set = cb_set
+        self.cb_override = cb_override
         self.config_key = config
         self.checker = None
+        self.config = self._get_config(Config().snapshot())
+        Config().subscribe(self.configure, ('conditions',))
+
+    def _get_config(self, config):
+        return (config.conditions.enabled, getattr(config.conditions, self.config_key))
 
     def _init_condition_checkers(self):
         conditions = Config().get('conditions', self.config_key)
         if not bool(conditions):
             return None
+        # pylint: disable-next=import-outside-toplevel
+        from condition_checker_xserver import ConditionCheckerXserver
         return ConditionCheckerXserver(conditions)
 
+    def configure(self, config):
+        """Apply changed conditions from a configuration snapshot"""
+        previous_config, self.config = (self.config, self._get_config(config))
+        if self.config == previous_config:
+            return
+        enabled = self.config[0] if self.config[0] != previous_config[0] else self.is_enabled()
+        self.set_enabled(False)
+        self.set_enabled(enabled)
+
     def is_enabled(self) -> bool:
         """Return whether the condition is enabled"""
         return self.checker is not None
@@ -34,6 +55,7 @@ class ConditionChecker():
         """Enable/disable the condition checker"""
         if not enabled:
             self.checker = None
+            self._end_override()
             return
         if not self.is_enabled():
             self.checker = self._init_condition_checkers()
@@ -47,13 +69,26 @@ class ConditionChecker():
 
         if (condition_check is None) or (condition_check == self.previous_condition):
             return
-        self.previous_condition = condition_check
 
         if condition_check is True:
+            self.previous_condition = True
             self.original_value = self.cb_get()
+            self._set_override(True)
             self.cb_set(self.true_value)
-            print('condition check override start')
+            LOG.info('Condition override start', brightness=self.true_value)
 
         if condition_check is False:
-            self.cb_set(self.original_value)
-            print('condition check override end')
+            self._end_override()
+
+    def _end_override(self):
+        """Restore the intercept from before the override, if one is active"""
+        if not self.previous_condition:
+            return
+        self.previous_condition = False
+        self._set_override(False)
+        self.cb_set(self.original_value)
+        LOG.info('Condition override end', intercept=self.original_value)
+
+    def _set_override(self, active):
+        if callable(self.cb_override):
+            self.cb_override(active)
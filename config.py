@@ -1,6 +1,13 @@
 """Module to manage configuration files"""
 import os
+import atexit
+import tempfile
+import threading
+from collections import namedtuple
 from configparser import ConfigParser, _UNSET, Error # type: ignore[attr-defined]
+from log import get_logger
+
+LOG = get_logger('config')
 
 class NoDefaultError(Error):
     """Raised when no default is present for the given option"""
@@ -8,11 +15,10 @@ class NoDefaultError(Error):
         super().__init__(f'No default set for option {option} in section: {section}')
 
 
-# pylint: disable-next=too-many-ancestors
+# pylint: disable-next=too-many-ancestors,too-many-instance-attributes
 class Config(ConfigParser):
     """Manage configuration files"""
     _instance = None
-    _original_instance = None
 
     def __new__(cls, *args, **kwargs):
         if not isinstance(cls._instance, cls):
@@ -21,17 +27,41 @@ class Config(ConfigParser):
 
     def __init__(self, initialize=False):
         if initialize is True:
+            self._dirty = {}
+            self._lock = threading.Lock()
+            self._save_lock = threading.Lock()
+            self._autosave_delay = None
+            self._autosave_timer = None
+            self._snapshot = None
+            self._values = {}
+            self._subscribers = []
             super().__init__()
             self.read(self._get_config_file_paths())
 
     # pylint: disable-next=unused-argument
     def get(self, section, option, *args, fallback=_UNSET, **kwargs):
-        default_value = self._config_defaults().get(section, {}).get(option, _UNSET)
+        if not bool(args) and not bool(kwargs):
+            self.snapshot()
+            value = self._values.get((section, option), _UNSET)
+            if value is not _UNSET:
+                return value
+        return self._get_option(section, option, *args, **kwargs)
+
+    def _get_option(self, section, option, *args, **kwargs):
+        """Parse an option, falling back to its default value"""
+        template = section.split(':', 1)[0]
+        default_value = self._config_defaults().get(template, {}).get(option, _UNSET)
 
         if default_value is _UNSET:
             raise NoDefaultError(option, section)
 
+        # Sections named 'template:name' fall back to the values of the template section
+        if template != section:
+            default_value = self.get(template, option)
+
         if not bool(kwargs):
+            if not self.has_option(section, option):
+                return default_value
             if isinstance(default_value, bool):
                 return self.getboolean(section, option, fallback=default_value)
             if isinstance(default_value, int):
@@ -41,38 +71,189 @@ class Config(ConfigParser):
 
         return super().get(section, option, *args, fallback=default_value, **kwargs)
 
-    def save(self):
-        """Write current data to configuration file"""
-        config_changes = self._changes()
-        if config_changes is None:
+    def set(self, section, option, value=None):
+        """Set an option and mark it to be saved, raise ValueError if it does not parse"""
+        self._validate(section, option, value)
+        if not self.has_section(section):
+            self.add_section(section)
+        unchanged = self.has_option(section, option) and \
+            super().get(section, option, raw=True) == value
+        super().set(section, option, value)
+        with self._lock:
+            self._dirty[(section, option)] = value
+        if self._autosave_delay is not None:
+            self._schedule_save()
+        if not unchanged:
+            self._update_snapshot(section)
+            self._changed({section.split(':', 1)[0]})
+
+    def _validate(self, section, option, value):
+        """Raise ValueError if a value does not parse as the type of the option's default"""
+        template = section.split(':', 1)[0]
+        default_value = self._config_defaults().get(template, {}).get(option, _UNSET)
+        if value is None or default_value is _UNSET:
             return
+        if isinstance(default_value, bool):
+            self._convert_to_boolean(value)
+        elif isinstance(default_value, (int, float)):
+            type(default_value)(value)
 
-        path = self._get_config_file_paths()[-1]
+    def reload(self):
+        """Read the configuration files again, unsaved changes are kept
+
+        The files are parsed and checked on their own first, if they have an error it is
+        logged and the current configuration stays in use. Returns whether it was replaced.
+        """
+        with self._lock:
+            dirty = dict(self._dirty)
+        parsed = ConfigParser()
         try:
-            if not os.path.exists(os.path.dirname(path)):
-                os.mkdir(os.path.dirname(path), mode=0o755)
-            with open(path, 'w', encoding='utf-8') as config_file:
-                config_changes.write(config_file)
-            self._original().read_dict(config_changes)
-        except (FileNotFoundError, OSError) as exception:
-            print(f'Could not save configuration: {exception}')
-
-    def _changes(self):
-        changes = {}
-        for section_name, section in self.items():
-            for option, value in section.items():
-                if self._original().get(section_name, option) == value:
-                    continue
-                if section_name not in changes:
-                    changes[section_name] = {}
-                changes[section_name][option] = value
-
-        if not bool(changes):
-            return None
-
-        config_changes = ConfigParser()
-        config_changes.read_dict(changes)
-        return config_changes
+            parsed.read(self._get_config_file_paths())
+            for (section, option), value in dirty.items():
+                if not parsed.has_section(section):
+                    parsed.add_section(section)
+                parsed.set(section, option, value)
+            for section in parsed.sections():
+                for option, value in parsed.items(section):
+                    self._validate(section, option, value)
+        except (Error, ValueError) as exception:
+            LOG.error('Configuration not reloaded', error=exception)
+            return False
+
+        for section in self.sections():
+            self.remove_section(section)
+        self.read_dict({section: dict(parsed.items(section, raw=True)) for section in parsed})
+        self._snapshot = None
+        self._changed()
+        return True
+
+    def snapshot(self):
+        """Return the typed values of every option with a default
+
+        Sections and options are attributes of the returned immutable object. It is
+        compiled once and rebuilt only after the configuration changes.
+        """
+        if self._snapshot is None:
+            self._values = {}
+            sections = {}
+            for section, defaults in self._config_defaults().items():
+                values = {option: self._get_option(section, option) for option in defaults}
+                self._values.update({(section, key): value for key, value in values.items()})
+                sections[section] = namedtuple(section, values)(**values)
+            self._snapshot = namedtuple('Snapshot', sections)(**sections)
+        return self._snapshot
+
+    def _update_snapshot(self, section):
+        """Rebuild the values of a changed section in the snapshot"""
+        defaults = self._config_defaults().get(section)
+        if self._snapshot is None or defaults is None:
+            return
+        values = {option: self._get_option(section, option) for option in defaults}
+        self._values.update({(section, key): value for key, value in values.items()})
+        self._snapshot = self._snapshot._replace(
+            **{section: getattr(self._snapshot, section)._replace(**values)}
+        )
+
+    def subscribe(self, callback, sections=None):
+        """Call callback with the new snapshot whenever the configuration changes
+
+        With sections given, only changes to those sections and to the 'section:name'
+        sections based on them call the callback.
+        """
+        self._subscribers.append((callback, None if sections is None else frozenset(sections)))
+
+    def _changed(self, sections=None):
+        """Notify the subscribers of the changed sections, all of them if sections is None"""
+        callbacks = [
+            callback for callback, subscribed in self._subscribers
+            if sections is None or subscribed is None or not subscribed.isdisjoint(sections)
+        ]
+        if not bool(callbacks):
+            return
+        snapshot = self.snapshot()
+        for callback in callbacks:
+            callback(snapshot)
+
+    def set_autosave(self, delay):
+        """Save changes in the background once no change was made for delay seconds
+
+        Autosave is disabled if delay is None.
+        """
+        self._autosave_delay = delay
+        atexit.unregister(self.flush)
+        if delay is not None:
+            atexit.register(self.flush)
+
+    def _schedule_save(self):
+        """Restart the autosave timer"""
+        with self._lock:
+            if self._autosave_timer is not None:
+                self._autosave_timer.cancel()
+            self._autosave_timer = threading.Timer(self._autosave_delay, self.save)
+            self._autosave_timer.daemon = True
+            self._autosave_timer.start()
+
+    def flush(self):
+        """Save pending changes right away"""
+        with self._lock:
+            if self._autosave_timer is not None:
+                self._autosave_timer.cancel()
+                self._autosave_timer = None
+        self.save()
+
+    def save(self):
+        """Write changed options to the configuration file"""
+        with self._save_lock:
+            with self._lock:
+                dirty, self._dirty = (self._dirty, {})
+            if not bool(dirty):
+                return
+
+            path = self._get_config_file_paths()[-1]
+            try:
+                saved = self._changes(path, dirty)
+                if saved is not None:
+                    self._write_atomic(path, saved)
+            except (FileNotFoundError, OSError) as exception:
+                LOG.error('Could not save configuration', path=path, error=exception)
+                with self._lock:
+                    self._dirty = {**dirty, **self._dirty}
+
+    @staticmethod
+    def _changes(path, dirty):
+        """Apply changed options to the saved configuration, None if nothing changed"""
+        saved = ConfigParser(interpolation=None)
+        saved.read(path, encoding='utf-8')
+
+        changed = False
+        for (section, option), value in dirty.items():
+            if saved.has_option(section, option) and saved.get(section, option) == value:
+                continue
+            if not saved.has_section(section):
+                saved.add_section(section)
+            saved.set(section, option, value)
+            changed = True
+
+        return saved if changed else None
+
+    @staticmethod
+    def _write_atomic(path, data):
+        """Write to a temporary file and move it over the configuration file"""
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory, mode=0o755)
+
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+        try:
+            os.fchmod(file_descriptor, 0o644)
+            with os.fdopen(file_descriptor, 'w', encoding='utf-8') as config_file:
+                data.write(config_file)
+                config_file.flush()
+                os.fsync(config_file.fileno())
+            os.replace(temp_path, path)
+        except OSError:
+            os.unlink(temp_path)
+            raise
 
     @classmethod
     def _get_new_instance(cls, *args, **kwargs):
@@ -80,6 +261,11 @@ class Config(ConfigParser):
         instance.__init__(initialize=True)
         return instance
 
+    @classmethod
+    def get_config_file_paths(cls):
+        """Return the configuration files in the order they are read"""
+        return cls._get_config_file_paths()
+
     @classmethod
     def _get_config_file_paths(cls):
         dirname = os.path.dirname(os.path.abspath(__file__))
@@ -93,12 +279,6 @@ class Config(ConfigParser):
             ),
         )
 
-    @classmethod
-    def _original(cls):
-        if not isinstance(cls._original_instance, cls):
-            cls._original_instance = cls._get_new_instance()
-        return cls._original_instance
-
     @staticmethod
     def _config_name():
         """Returns the name of the application"""
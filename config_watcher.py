@@ -0,0 +1,82 @@
+"""Detect changes of configuration files"""
+import os
+import struct
+import ctypes
+import ctypes.util
+
+class ConfigWatcher:
+    """Watch configuration files through inotify, polling their status as a fallback"""
+    # Files are read once they are written and closed or moved into place, not while they
+    # are being written
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, paths):
+        self.paths = tuple(os.path.abspath(path) for path in paths)
+        self.names = {os.path.basename(path) for path in self.paths}
+        self.inotify_fd = self._init_inotify()
+        self.status = self._get_status() if self.inotify_fd is None else None
+
+    def _init_inotify(self):
+        """Watch the directories of the files, returns None if inotify can not be used"""
+        directories = {os.path.dirname(path) for path in self.paths}
+        if not all(os.path.isdir(directory) for directory in directories):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            inotify_fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if inotify_fd < 0:
+            return None
+
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        for directory in directories:
+            if libc.inotify_add_watch(inotify_fd, os.fsencode(directory), mask) < 0:
+                os.close(inotify_fd)
+                return None
+        return inotify_fd
+
+    def _get_status(self):
+        """Modification time, size and inode of every file"""
+        status = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                status.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+            except OSError:
+                status.append(None)
+        return status
+
+    def _read_events(self):
+        """Return whether any of the files had an event since the last call"""
+        changed = False
+        while True:
+            try:
+                data = os.read(self.inotify_fd, 4096)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if os.fsdecode(name) in self.names:
+                    changed = True
+
+    def poll(self):
+        """Return whether the files changed since the last call, never blocks"""
+        if self.inotify_fd is not None:
+            return self._read_events()
+
+        status = self._get_status()
+        changed, self.status = (status != self.status, status)
+        return changed
+
+    def close(self):
+        """Stop watching the files"""
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
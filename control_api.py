@@ -0,0 +1,87 @@
+"""Control ZenDisplay from other programs"""
+import os
+from zendisplay_config import Config
+from control_socket import ControlSocket
+
+class ControlApi:
+    """Commands to query and change the state of a ZenDisplay instance
+
+    Commands, one per line: get, set-intercept <value>, set-brightness <value>,
+    sensor <id>, subscribe, unsubscribe. Every command is answered with a line of JSON,
+    subscribers also receive events as they happen.
+    """
+    def __init__(self, zendisplay):
+        self.zendisplay = zendisplay
+        self.commands = {
+            'get': self._get,
+            'set-intercept': self._set_intercept,
+            'set-brightness': self._set_brightness,
+            'sensor': self._set_sensor,
+        }
+        self.socket = ControlSocket(self.get_socket_path(), self.handle)
+
+    @staticmethod
+    def get_socket_path():
+        """Path of the control socket, in the private runtime directory of the user"""
+        path = Config().get('api', 'path')
+        if bool(path):
+            return path
+        runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+        if not bool(runtime_dir):
+            # A fixed name in a shared directory could be taken by another user first
+            raise OSError('XDG_RUNTIME_DIR is not set, set api.path to place the socket')
+        return os.path.join(runtime_dir, f'zendisplay-{os.getuid()}.sock')
+
+    def handle(self, line, reply):
+        """Run a command on the main loop and reply with the result"""
+        self.zendisplay.call_soon(lambda: reply(self._run(line)))
+
+    def _run(self, line):
+        """Run a command and return the response"""
+        command, *arguments = line.split()
+        if command not in self.commands:
+            return {'ok': False, 'error': f'unknown command: {command}'}
+        try:
+            return {'ok': True, **(self.commands[command](*arguments) or {})}
+        except (TypeError, ValueError, IndexError) as exception:
+            return {'ok': False, 'error': str(exception)}
+
+    def publish(self, event, **data):
+        """Push an event to subscribers"""
+        self.socket.publish({'event': event, **data})
+
+    def _get(self):
+        """Current state of the controller, sensors and displays"""
+        zendisplay = self.zendisplay
+        return {
+            'intercept': zendisplay.controller.line_b,
+            'luminance': zendisplay.controller.luminance,
+            'sensor': zendisplay.sensors.get_active(),
+            'sensors': [
+                {'id': sensor.uid, 'name': sensor.name, 'ready': sensor.is_ready()}
+                for sensor in zendisplay.sensors
+            ],
+            'displays': [
+                {
+                    'id': display.uid,
+                    'name': display.name,
+                    'enabled': display.enabled,
+                    'brightness': display.get_target_brightness(),
+                }
+                for display in zendisplay.displays
+            ],
+            'writes': zendisplay.displays.get_write_counters(),
+        }
+
+    def _set_intercept(self, value):
+        self.zendisplay.set_intercept(max(min(int(value), 100), 0))
+
+    def _set_brightness(self, value):
+        self.zendisplay.set_brightness(max(min(int(value), 100), 0))
+
+    def _set_sensor(self, sensor_id):
+        sensor_id = int(sensor_id)
+        if not 0 <= sensor_id < len(self.zendisplay.sensors):
+            raise IndexError(f'no sensor with id {sensor_id}')
+        self.zendisplay.sensors.activate(sensor_id)
+        self.publish('sensor', id=sensor_id)
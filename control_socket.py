@@ -0,0 +1,188 @@
+"""Line based control protocol over a Unix socket"""
+import os
+import json
+import stat
+import socket
+import selectors
+import threading
+
+# pylint: disable-next=too-many-instance-attributes
+class ControlSocket:
+    """Serve JSON responses to line based commands and push events to subscribers
+
+    Commands are passed to the handler as lines of text together with a reply callback.
+    The 'subscribe' and 'unsubscribe' commands are handled by the socket itself. Messages
+    sent from any thread are queued per client and written by the socket thread without
+    blocking, a client falling too far behind is dropped.
+    """
+    # Bytes of queued output a client may fall behind by
+    MAX_PENDING = 1 << 20
+
+    def __init__(self, path, handler):
+        self.path = path
+        self.handler = handler
+        self.subscribers = set()
+        # Output queued for every connected client, and clients to drop
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.dropped = set()
+        self.selector = selectors.DefaultSelector()
+        self.server = self._bind(path)
+        self.selector.register(self.server, selectors.EVENT_READ)
+        self.wakeup, self.wakeup_sender = socket.socketpair()
+        for wakeup_socket in (self.wakeup, self.wakeup_sender):
+            wakeup_socket.setblocking(False)
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self._run, name='control socket', daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _bind(path):
+        """Create the listening socket, replacing a stale socket but no other file"""
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise OSError(f'{path} exists and is not a socket')
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(path)
+                    raise OSError(f'{path} is in use by another instance')
+                except ConnectionRefusedError:
+                    os.unlink(path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        os.chmod(path, 0o600)
+        server.listen()
+        server.setblocking(False)
+        return server
+
+    def _run(self):
+        """Accept connections, read commands and write queued output"""
+        while True:
+            for key, events in self.selector.select():
+                if key.fileobj is self.server:
+                    self._accept()
+                elif key.fileobj is self.wakeup:
+                    self._drain_wakeup()
+                else:
+                    if events & selectors.EVENT_WRITE:
+                        self._write(key.fileobj)
+                    if events & selectors.EVENT_READ and key.fileobj in self.pending:
+                        self._read(key.fileobj, key.data)
+            self._update_selector()
+
+    def _accept(self):
+        """Accept a new client"""
+        try:
+            connection, _ = self.server.accept()
+        except OSError:
+            return
+        connection.setblocking(False)
+        with self.lock:
+            self.pending[connection] = bytearray()
+        self.selector.register(connection, selectors.EVENT_READ, bytearray())
+
+    def _drain_wakeup(self):
+        """Consume the wakeups sent with queued output"""
+        try:
+            while self.wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _update_selector(self):
+        """Drop clients that fell behind, wait for writability while output is queued"""
+        with self.lock:
+            dropped, self.dropped = (self.dropped, set())
+            waiting = {connection for connection, output in self.pending.items() if output}
+        for connection in dropped:
+            self._close(connection)
+        for key in list(self.selector.get_map().values()):
+            if key.fileobj in (self.server, self.wakeup):
+                continue
+            events = selectors.EVENT_READ
+            if key.fileobj in waiting:
+                events |= selectors.EVENT_WRITE
+            if key.events != events:
+                self.selector.modify(key.fileobj, events, key.data)
+
+    def _read(self, connection, buffer):
+        """Read data from a client and handle every complete line"""
+        try:
+            data = connection.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not bool(data):
+            self._close(connection)
+            return
+
+        buffer += data
+        while b'\n' in buffer:
+            line, _, rest = bytes(buffer).partition(b'\n')
+            buffer[:] = rest
+            self._command(connection, line.decode('utf-8', errors='replace').strip())
+
+    def _write(self, connection):
+        """Write as much queued output as the client accepts"""
+        with self.lock:
+            data = bytes(self.pending[connection])
+        try:
+            sent = connection.send(data)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._close(connection)
+            return
+        with self.lock:
+            del self.pending[connection][:sent]
+
+    def _command(self, connection, line):
+        """Handle a single command"""
+        if not bool(line):
+            return
+        if line == 'subscribe':
+            with self.lock:
+                self.subscribers.add(connection)
+            self.send(connection, {'ok': True})
+        elif line == 'unsubscribe':
+            with self.lock:
+                self.subscribers.discard(connection)
+            self.send(connection, {'ok': True})
+        else:
+            self.handler(line, lambda message: self.send(connection, message))
+
+    def send(self, connection, message):
+        """Queue a message as a line of JSON, safe to call from any thread"""
+        data = (json.dumps(message, separators=(',', ':')) + '\n').encode('utf-8')
+        with self.lock:
+            output = self.pending.get(connection)
+            if output is None:
+                return
+            if len(output) + len(data) > self.MAX_PENDING:
+                self.dropped.add(connection)
+            else:
+                output += data
+        try:
+            self.wakeup_sender.send(b'\0')
+        except BlockingIOError:
+            pass
+
+    def publish(self, message):
+        """Push a message to every subscriber"""
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for connection in subscribers:
+            self.send(connection, message)
+
+    def _close(self, connection):
+        """Forget a client, only called from the socket thread"""
+        with self.lock:
+            self.pending.pop(connection, None)
+            self.subscribers.discard(connection)
+        try:
+            self.selector.unregister(connection)
+        except (KeyError, ValueError):
+            pass
+        connection.close()
@@ -1,20 +1,58 @@
 """Logic to calculate the next display brightness value"""
+import time
 from zendisplay_config import Config
+from brightness_curve import LearnedCurve
+from log import get_logger
 
+LOG = get_logger('controller')
+
+# pylint: disable-next=too-many-instance-attributes
 class Controller:
     """Recommends new brightness value based on current data"""
+    CORRECTION_WINDOW = 3.0
+
     def __init__(self):
-        self.brightness_increment = Config().get('brightness', 'increment')
-        self.brightness_margin = Config().get('brightness', 'margin')
-        self.line_m = Config().get('brightness', 'slope')
-        self.line_b = Config().get('brightness', 'base_value')
+        config = Config().snapshot()
+        self.brightness_increment = config.brightness.increment
+        self.brightness_margin = config.brightness.margin
+        self.line_m = config.brightness.slope
+        self.line_b = config.brightness.base_value
+        self.luminance = None
+        self.recommended = None
+        self.learning_paused = False
+        self.correction = None
+        self.curve = None
+        if config.learning.enabled is True:
+            self.curve = LearnedCurve.from_string(config.learning.bins, config.learning.decay)
+        Config().subscribe(self.configure, ('brightness',))
+
+    def configure(self, config):
+        """Update parameters from a configuration snapshot"""
+        self.brightness_increment = config.brightness.increment
+        self.brightness_margin = config.brightness.margin
+        self.line_m = config.brightness.slope
+        self.line_b = config.brightness.base_value
+
+    def _line(self, luminance):
+        """Brightness on the configured line without learned corrections"""
+        return self.line_m * luminance + self.line_b
+
+    def is_learning(self):
+        """Return whether user adjustments are learned as corrections"""
+        return self.curve is not None and self.luminance is not None and not self.learning_paused
+
+    def set_learning_paused(self, paused):
+        """Pause learning, user adjustments move the intercept instead"""
+        self.learning_paused = paused
 
     def calculate_brightness(self, luminance):
         """Calculate brightness from ambient lighting"""
-        value = round(self.line_m * luminance + self.line_b)
-        return max(min(100, value), 0)
+        value = self._line(luminance)
+        if self.curve is not None and not self.learning_paused:
+            value += self.curve.offset(luminance)
+        return max(min(100, round(value)), 0)
 
-    def brightness_should_change(self, old_brightness, new_brightness):
+    def brightness_should_change(self, old_brightness, new_brightness, margin=None):
         """Determine whether the brightness should be changed"""
         if old_brightness == new_brightness:
             return False
@@ -22,23 +60,65 @@ class Controller:
         if new_brightness in (0, 100) or old_brightness is None:
             return True
 
-        return abs(old_brightness - new_brightness) >= self.brightness_margin
+        if margin is None:
+            margin = self.brightness_margin
+        return abs(old_brightness - new_brightness) >= margin
 
-    def recommend_brightness(self, current_luminance, current_brightness):
-        """Get a new brightness value based on current data"""
+    def recommend_brightness(
+        self, current_luminance, current_brightness, profile=None, force=False,
+    ):
+        """Get a new brightness value based on current data
+
+        Forced recommendations ignore the margin, used when the user or a condition
+        changes the brightness.
+        """
+        self.luminance = current_luminance
         recommended_brightness = self.calculate_brightness(current_luminance)
+        margin = None
+        if profile is not None:
+            recommended_brightness = profile.apply(recommended_brightness)
+            margin = profile.get_margin(self.brightness_margin)
+        self.recommended = recommended_brightness
 
-        if not self.brightness_should_change(current_brightness, recommended_brightness):
+        if force:
+            margin = 0
+        if not self.brightness_should_change(current_brightness, recommended_brightness, margin):
+            return None
+        if not force and profile is not None and not profile.budget.allows():
             return None
 
-        print((
-            f'Brightness: {int(current_brightness or 0):3d}% -> '
-            f'{recommended_brightness:3d}% '
-            f'(luminance: {current_luminance:.1f} lx)'
-        ))
+        LOG.info(
+            'Brightness change',
+            display=profile.name if profile is not None else None,
+            old=int(current_brightness or 0),
+            new=recommended_brightness,
+            luminance=f'{current_luminance:.1f}',
+        )
 
         return recommended_brightness
 
+    def add_correction(self, change):
+        """Learn a user adjustment of the brightness at the current luminance
+
+        Adjustments following each other within the correction window count as one sample.
+        """
+        now = time.monotonic()
+        amend = self.correction is not None and now - self.correction[0] < self.CORRECTION_WINDOW
+        start = self.correction[1] if amend else self.calculate_brightness(self.luminance)
+        target = max(min(100, start + change), 0)
+        self.curve.add_sample(self.luminance, target - self._line(self.luminance), amend)
+        self.correction = (now, target)
+        Config().set('learning', 'bins', str(self.curve))
+        return target
+
+    def intercept_for(self, brightness):
+        """Intercept at which the last luminance results in the given brightness"""
+        luminance = self.luminance or 0
+        value = brightness - self.line_m * luminance
+        if self.curve is not None and not self.learning_paused:
+            value -= self.curve.offset(luminance)
+        return round(value)
+
     def set_intercept(self, value):
         """Set the slope of the brightness function"""
         self.line_b = value
@@ -46,10 +126,14 @@ class Controller:
 
     def increase_intercept(self):
         """Increase brightness function intercept"""
+        if self.is_learning():
+            return self.add_correction(self.brightness_increment)
         self.set_intercept(min(self.line_b + self.brightness_increment, 100))
         return self.line_b
 
     def decrease_intercept(self):
         """Decrease brightness function intercept"""
+        if self.is_learning():
+            return self.add_correction(-self.brightness_increment)
         self.set_intercept(max(self.line_b - self.brightness_increment, 0))
         return self.line_b
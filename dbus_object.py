@@ -50,6 +50,10 @@ class DBusObject(DBusObjectFreeDesktop):
         """Get the value of a property"""
         return self.interface(self.interface_properties).Get(self.bus_name, property_name)
 
+    def get_properties(self, **handlers):
+        """Get every property, without blocking if reply_handler and error_handler are given"""
+        return self.interface(self.interface_properties).GetAll(self.bus_name, **handlers)
+
     def set_property(self, property_name, value):
         """Set the value of a property"""
         self.interface(self.interface_properties).Set(self.bus_name, property_name, value)
@@ -0,0 +1,72 @@
+"""Learn how short the DDC/CI delays of a display can be"""
+import threading
+from zendisplay_config import Config
+from display_state import DisplayState
+from metrics import Metrics
+
+class DDCTiming:
+    """Sleep multiplier of a display, lowered while transfers succeed and raised on errors
+
+    The multiplier scales the delays of the DDC/CI standard. After a run of successful
+    transfers it is lowered a step. A timing error doubles it and keeps probing above the
+    value that failed, that floor decays again while transfers succeed. The learned value is
+    stored with the display state.
+    """
+    MINIMUM = 0.1
+    MAXIMUM = 4.0
+    STEP_DOWN = 0.85
+    STEP_UP = 2.0
+    FLOOR_DECAY = 0.9
+    PROBE_AFTER = 20
+
+    def __init__(self, name, multiplier=1.0, adaptive=True):
+        self.name = name
+        self.multiplier = multiplier
+        self.adaptive = adaptive
+        self.floor = self.MINIMUM
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, name):
+        """Create the timing with the value learned earlier or configured for the display"""
+        section = f'display:{name}'
+        adaptive = Config().get(section, 'adaptive_timing')
+        multiplier = DisplayState().get(name, 'sleep_multiplier') if adaptive else None
+        if multiplier is None:
+            multiplier = Config().get(section, 'sleep_multiplier')
+        return cls(name, min(max(multiplier, cls.MINIMUM), cls.MAXIMUM), adaptive)
+
+    def get_multiplier(self):
+        """Current sleep multiplier"""
+        return self.multiplier
+
+    def success(self):
+        """Count a transaction that worked, probe a shorter delay after enough of them"""
+        if not self.adaptive:
+            return
+        with self.lock:
+            self.successes += 1
+            if self.successes < self.PROBE_AFTER:
+                return
+            self.successes = 0
+            self.floor = max(self.floor * self.FLOOR_DECAY, self.MINIMUM)
+            self._update(max(self.multiplier * self.STEP_DOWN, self.floor))
+
+    def failure(self):
+        """Back off after a transaction failed because of its timing, a garbled reply"""
+        if not self.adaptive:
+            return
+        with self.lock:
+            self.successes = 0
+            # Do not probe the failing value again for a while
+            self.floor = min(max(self.floor, self.multiplier / self.STEP_DOWN), self.MAXIMUM)
+            self._update(min(self.multiplier * self.STEP_UP, self.MAXIMUM))
+
+    def _update(self, multiplier):
+        multiplier = round(multiplier, 2)
+        if multiplier == self.multiplier:
+            return
+        self.multiplier = multiplier
+        Metrics().set_gauge('ddc_sleep_multiplier', multiplier, display=self.name)
+        DisplayState().set(self.name, multiplier, 'sleep_multiplier')
@@ -1,6 +1,7 @@
 """Wrapper module for dbus brightness"""
 import dbus
 from base_classes import Display
+from metrics import Metrics
 
 class DisplayDBus(Display):
     """Handle displays through dbus"""
@@ -54,8 +55,12 @@ class DisplayDBus(Display):
     def get_brightness(self):
         """Return last brightness value"""
         if self.enabled:
-            return int(self.func_get())
+            with Metrics().timer('backend_io_seconds', backend='dbus', operation='get'):
+                self.brightness = int(self.func_get())
+            return self.brightness
         return None
 
     def _set_brightness(self, brightness):
-        self.func_set(dbus.UInt32(brightness))
+        with Metrics().timer('backend_io_seconds', backend='dbus', operation='set'):
+            self.func_set(dbus.UInt32(brightness))
+        self.brightness = brightness
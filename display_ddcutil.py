@@ -1,21 +1,40 @@
 """Wrapper module for ddcutil"""
+import shlex
 import subprocess
-from base_classes import Display
+from zendisplay_config import Config
+from base_classes import DDCDisplay
+from bus_lock import BusLock, BusBusy
+from metrics import Metrics
+from log import get_logger
 
-class DisplayDDCUtil(Display):
+LOG = get_logger('ddcutil')
+
+class DisplayDDCUtil(DDCDisplay):
     """Handle displays through ddcutil"""
+    READ_ERRORS = (subprocess.CalledProcessError, ValueError, IndexError)
+    VERBS = ('detect', 'getvcp', 'setvcp')
+    # Errors of garbled or missing replies, a longer sleep multiplier can help with them
+    TIMING_ERRORS = (
+        'DDCRC_RETRIES', 'DDCRC_ALL_TRIES_ZERO', 'DDCRC_NULL_RESPONSE',
+        'DDCRC_ALL_RESPONSES_NULL', 'DDCRC_READ_ALL_ZERO', 'DDCRC_CHECKSUM',
+        'DDCRC_DDC_DATA', 'DDCRC_RESPONSE_ENVELOPE', 'DDCRC_PACKET_SIZE', 'DDCRC_INVALID_DATA',
+    )
+
     def __init__(self, name=None, path=None, bus=None):
         super().__init__(name, path)
         self.bus = bus
-        self.brightness = None
+        self.bus_lock = BusLock.for_bus(bus)
 
     @classmethod
     def detect(cls, parameters=None):
         """Find all displays connected to the system"""
         try:
             output = cls.command("detect")
-        except subprocess.CalledProcessError:
-            print('ddcutil detect failed')
+        except subprocess.CalledProcessError as exception:
+            LOG.warning('ddcutil detect failed', error=exception)
+            return
+        except FileNotFoundError:
+            LOG.warning('ddcutil not found')
             return
 
         current_valid = False
@@ -44,43 +63,66 @@ class DisplayDDCUtil(Display):
     @classmethod
     def command(cls, cmd):
         """Run a command through ddcutil"""
-        command = ['ddcutil', "--brief"]
+        command = shlex.split(Config().get('general', 'ddcutil_path')) + ["--brief"]
         try:
             cmd = cmd.split()
         except AttributeError:
             pass
         command += cmd
 
-        output = subprocess.run(
-            command,
-            stdout=subprocess.PIPE,
-            check=True
-        ).stdout.decode('utf-8').strip()
+        operation = next((item for item in cmd if item in cls.VERBS), 'other')
+        Metrics().count('ddcutil_calls_total', operation=operation)
+        try:
+            with Metrics().timer('backend_io_seconds', backend='ddcutil', operation=operation):
+                output = subprocess.run(
+                    command,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    check=True
+                ).stdout.decode('utf-8').strip()
+        except subprocess.CalledProcessError as exception:
+            Metrics().count('backend_errors_total', backend='ddcutil', operation=operation)
+            LOG.info(
+                'ddcutil failed', operation=operation,
+                error=exception.stderr.decode('utf-8', 'replace').strip(),
+            )
+            raise
+        except OSError:
+            Metrics().count('backend_errors_total', backend='ddcutil', operation=operation)
+            raise
 
         return output
 
-    def read_brightness(self):
-        """Get brightness from the display"""
+    def _bus_command(self, cmd):
+        """Run a command on the locked bus of the display with its learned sleep multiplier"""
+        multiplier = f'{self.timing.get_multiplier():.2f}'
         try:
-            data = self.command(['--bus', str(self.bus), 'getvcp', '0x10'])
-            self.brightness = int(data.split()[3])
-        except subprocess.CalledProcessError:
-            self.brightness = None
-            print('ddcutil getvcp failed')
-
-    def get_brightness(self):
-        """Return last brightness value"""
-        if not self.enabled:
-            return None
+            with self.bus_lock.hold():
+                output = self.command(
+                    ['--bus', str(self.bus), '--sleep-multiplier', multiplier] + cmd
+                )
+        except subprocess.CalledProcessError as exception:
+            if self._is_timing_error(exception):
+                self.timing.failure()
+            raise
+        self.timing.success()
+        return output
 
-        if self.brightness is None:
-            self.read_brightness()
+    @classmethod
+    def _is_timing_error(cls, exception):
+        """Return whether ddcutil failed on replies that a longer delay could fix"""
+        errors = exception.stderr.decode('utf-8', 'replace') if exception.stderr else ''
+        return any(error in errors for error in cls.TIMING_ERRORS)
 
-        return self.brightness
+    def _read_brightness(self):
+        """Get brightness from the display"""
+        return int(self._bus_command(['getvcp', '0x10']).split()[3])
 
     def _set_brightness(self, brightness):
         try:
-            self.command(['--bus', str(self.bus), 'setvcp', '0x10', str(brightness)])
-            self.brightness = brightness
-        except subprocess.CalledProcessError:
-            print('ddcutil setvcp failed')
+            self._bus_command(['setvcp', '0x10', str(brightness)])
+            self._brightness_written(brightness)
+        except BusBusy:
+            LOG.info('Bus busy, write deferred', display=self.name, bus=self.bus)
+        except (subprocess.CalledProcessError, OSError) as exception:
+            LOG.warning('ddcutil setvcp failed', display=self.name, bus=self.bus, error=exception)
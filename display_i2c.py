@@ -0,0 +1,216 @@
+"""Control displays through DDC/CI on I2C device files"""
+import os
+import glob
+import time
+import fcntl
+import threading
+from functools import reduce
+from zendisplay_config import Config
+from base_classes import DDCDisplay
+from bus_lock import BusLock, BusBusy
+from metrics import Metrics
+from log import get_logger
+
+LOG = get_logger('i2c')
+
+class DDCError(Exception):
+    """Raised when a display does not answer or answers with an invalid message"""
+
+
+class DDCReplyError(DDCError):
+    """Raised for a null, short or garbled reply, a longer delay may fix it"""
+
+
+class I2CDevice:
+    """I2C bus device file, kept open to talk to several addresses"""
+    I2C_SLAVE = 0x0703
+
+    def __init__(self, path):
+        self.path = path
+        self.address = None
+        self.file_descriptor = os.open(path, os.O_RDWR | os.O_CLOEXEC)
+
+    def select(self, address):
+        """Address the following reads and writes to the given device"""
+        if address != self.address:
+            fcntl.ioctl(self.file_descriptor, self.I2C_SLAVE, address)
+            self.address = address
+
+    def write(self, data):
+        """Write a message to the selected device"""
+        os.write(self.file_descriptor, data)
+
+    def read(self, count):
+        """Read a message from the selected device"""
+        return os.read(self.file_descriptor, count)
+
+    def close(self):
+        """Close the device file"""
+        os.close(self.file_descriptor)
+
+
+class DisplayI2C(DDCDisplay):
+    """Handle displays through DDC/CI without ddcutil
+
+    The bus is opened once and messages are spaced by the delays the DDC/CI standard requires.
+    DEVICE opens the bus, it can be replaced with an emulated device.
+    """
+    DEVICE = I2CDevice
+    DDC_ADDRESS = 0x37
+    EDID_ADDRESS = 0x50
+    HOST_ADDRESS = 0x51
+    VCP_BRIGHTNESS = 0x10
+    # Seconds to wait for a reply and after a message before the next one
+    REPLY_DELAY = 0.04
+    WRITE_DELAY = 0.05
+    RETRIES = 3
+    READ_ERRORS = (OSError, DDCError)
+    # Adapters that are not display connectors, probing them could confuse other devices
+    IGNORED_ADAPTERS = ('SMBus', 'soc:i2cdsi', 'smu', 'mac-io', 'u4')
+
+    def __init__(self, name=None, path=None, device=None):
+        super().__init__(name, path)
+        self.device = device
+        self.lock = threading.Lock()
+        self.ready_at = 0.0
+        self.bus_lock = BusLock.for_path(path)
+
+    @classmethod
+    def detect(cls, parameters=None):
+        """Find displays answering DDC/CI on the I2C buses"""
+        for path in sorted(glob.glob(os.path.join(Config().get('general', 'i2c_path'), 'i2c-*'))):
+            if cls._is_ignored(path):
+                continue
+            try:
+                device = cls.DEVICE(path)
+            except OSError:
+                continue
+
+            display = None
+            try:
+                display = cls(name=cls._read_name(device), path=path, device=device)
+                display.read_vcp(cls.VCP_BRIGHTNESS)
+            except BusBusy:
+                LOG.info('Bus busy during detection', display=display.name, bus=path)
+            except (OSError, DDCError) as exception:
+                LOG.debug('No DDC/CI display', bus=path, error=exception)
+                device.close()
+                continue
+            yield display
+
+    @classmethod
+    def _is_ignored(cls, path):
+        """Return whether the adapter of a bus is known not to be a display connector"""
+        name_path = os.path.join('/sys/class/i2c-dev', os.path.basename(path), 'name')
+        try:
+            with open(name_path, encoding='utf-8') as name_file:
+                return name_file.read().startswith(cls.IGNORED_ADAPTERS)
+        except OSError:
+            return False
+
+    @classmethod
+    def _read_name(cls, device):
+        """Name of the display from its EDID in the format ddcutil reports it"""
+        device.select(cls.EDID_ADDRESS)
+        device.write(b'\x00')
+        edid = device.read(128)
+        if len(edid) < 128 or edid[:8] != b'\x00\xff\xff\xff\xff\xff\xff\x00':
+            raise DDCError('Invalid EDID')
+
+        vendor = int.from_bytes(edid[8:10], 'big')
+        manufacturer = ''.join(chr(((vendor >> shift) & 0x1f) + 64) for shift in (10, 5, 0))
+        texts = {}
+        for offset in range(54, 126, 18):
+            descriptor = edid[offset:offset + 18]
+            if descriptor[:3] == b'\x00\x00\x00' and descriptor[3] in (0xfc, 0xff):
+                text = descriptor[5:].split(b'\x0a')[0].decode('ascii', 'replace').strip()
+                texts[descriptor[3]] = text
+        return f'{manufacturer}:{texts.get(0xfc, "")}:{texts.get(0xff, "")}'
+
+    @staticmethod
+    def _checksum(initial, data):
+        return reduce(lambda checksum, byte: checksum ^ byte, data, initial)
+
+    def _message(self, payload):
+        """Frame a DDC/CI payload with the host address, length and checksum"""
+        message = bytes((self.HOST_ADDRESS, 0x80 | len(payload))) + payload
+        return message + bytes((self._checksum(self.DDC_ADDRESS << 1, message),))
+
+    def _wait(self, delay=0.0):
+        """Sleep until the display can receive the next message, then reserve delay
+
+        Delays are scaled by the sleep multiplier learned for the display.
+        """
+        now = time.monotonic()
+        if now < self.ready_at:
+            time.sleep(self.ready_at - now)
+        self.ready_at = max(now, self.ready_at) + delay * self.timing.get_multiplier()
+
+    def _parse_reply(self, reply, code):
+        """Return the current and maximum value of a VCP feature reply"""
+        length = reply[1] & 0x7f if len(reply) > 1 else 0
+        if length == 0 or len(reply) < length + 3:
+            raise DDCReplyError('Null or short reply')
+        if self._checksum(self.EDID_ADDRESS, reply[:length + 2]) != reply[length + 2]:
+            raise DDCReplyError('Invalid checksum')
+        if reply[2] != 0x02 or reply[4] != code or length < 8:
+            raise DDCReplyError('Unexpected reply')
+        if reply[3] != 0x00:
+            raise DDCError(f'Unsupported VCP feature 0x{code:02x}')
+        return (int.from_bytes(reply[8:10], 'big'), int.from_bytes(reply[6:8], 'big'))
+
+    def _transaction(self, operation, function):
+        """Run a bus transaction with retries, raise BusBusy if another process uses the bus
+
+        The timing is charged one failure for a transaction that needed a retry because of
+        a garbled reply, other errors like a display that is off do not count.
+        """
+        with self.lock, self.bus_lock.hold(), \
+                Metrics().timer('backend_io_seconds', backend='i2c', operation=operation):
+            timing_error = False
+            for attempt in range(self.RETRIES):
+                try:
+                    self.device.select(self.DDC_ADDRESS)
+                    result = function()
+                    break
+                except (OSError, DDCError) as exception:
+                    timing_error = timing_error or isinstance(exception, DDCReplyError)
+                    if attempt == self.RETRIES - 1:
+                        if timing_error:
+                            self.timing.failure()
+                        Metrics().count('backend_errors_total', backend='i2c', operation=operation)
+                        raise
+            if timing_error:
+                self.timing.failure()
+            else:
+                self.timing.success()
+            return result
+
+    def read_vcp(self, code):
+        """Return the current and maximum value of a VCP feature"""
+        def get():
+            self._wait(self.REPLY_DELAY)
+            self.device.write(self._message(bytes((0x01, code))))
+            self._wait(self.WRITE_DELAY)
+            return self._parse_reply(self.device.read(11), code)
+        return self._transaction('getvcp', get)
+
+    def write_vcp(self, code, value):
+        """Set the value of a VCP feature"""
+        def set_value():
+            self._wait(self.WRITE_DELAY)
+            self.device.write(self._message(bytes((0x03, code)) + value.to_bytes(2, 'big')))
+        self._transaction('setvcp', set_value)
+
+    def _read_brightness(self):
+        """Get brightness from the display"""
+        return self.read_vcp(self.VCP_BRIGHTNESS)[0]
+
+    def _set_brightness(self, brightness):
+        try:
+            self.write_vcp(self.VCP_BRIGHTNESS, brightness)
+            self._brightness_written(brightness)
+        except BusBusy:
+            LOG.info('Bus busy, write deferred', display=self.name, bus=self.path)
+        except (OSError, DDCError) as exception:
+            LOG.warning('DDC/CI write failed', display=self.name, bus=self.path, error=exception)
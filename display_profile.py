@@ -0,0 +1,54 @@
+"""Per display control settings"""
+from zendisplay_config import Config
+from write_budget import WriteBudget
+
+class DisplayProfile:
+    """Adjust the recommended brightness and update cadence for one display"""
+    SCHEDULE_SLACK = 0.1
+
+    # pylint: disable-next=too-many-arguments
+    def __init__(
+        self, name=None, *, offset=0, scale=1.0, margin=None, interval=1.0, budget=None,
+    ):
+        self.name = name
+        self.offset = offset
+        self.scale = scale
+        self.margin = margin
+        self.interval = interval
+        self.budget = budget or WriteBudget()
+        self.last_update = None
+
+    @classmethod
+    def from_config(cls, name):
+        """Create the profile from the display's configuration section"""
+        profile = cls(name=name)
+        profile.configure()
+        return profile
+
+    def configure(self):
+        """Read the settings from the display's configuration section"""
+        section = f'display:{self.name}'
+        margin = Config().get(section, 'margin')
+        self.offset = Config().get(section, 'offset')
+        self.scale = Config().get(section, 'scale')
+        self.margin = margin if margin >= 0 else None
+        self.interval = Config().get(section, 'interval')
+        self.budget.configure(
+            rate=Config().get(section, 'write_rate'),
+            burst=Config().get(section, 'write_burst'),
+            step_factor=Config().get(section, 'write_step_factor'),
+        )
+
+    def apply(self, brightness):
+        """Convert the common brightness to the brightness of this display"""
+        return max(min(100, round(brightness * self.scale + self.offset)), 0)
+
+    def get_margin(self, default):
+        """Margin of the display, grows when the write budget runs short"""
+        return self.budget.scale_margin(default if self.margin is None else self.margin)
+
+    def is_due(self, now):
+        """Return whether the display should be updated at the given time"""
+        if self.last_update is None:
+            return True
+        return now - self.last_update >= self.interval - self.SCHEDULE_SLACK
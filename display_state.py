@@ -0,0 +1,105 @@
+"""Remember the brightness of displays across restarts"""
+import os
+import json
+import atexit
+import tempfile
+import threading
+from log import get_logger
+
+LOG = get_logger('display_state')
+
+class DisplayState:
+    """State learned about every display, by display name
+
+    Each display has the last brightness written to it and its DDC/CI sleep multiplier.
+    """
+    VALID = {
+        'brightness': lambda value: isinstance(value, int) and 0 <= value <= 100,
+        'sleep_multiplier': lambda value: isinstance(value, (int, float)) and value > 0,
+    }
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not isinstance(cls._instance, cls):
+            cls._instance = cls._get_new_instance()
+        return cls._instance
+
+    def __init__(self, initialize=False):
+        if initialize is True:
+            self.path = self.default_path()
+            self.lock = threading.Lock()
+            self.values = self._load()
+            self.dirty = False
+            atexit.register(self.save)
+
+    @classmethod
+    def _get_new_instance(cls):
+        instance = object.__new__(cls)
+        instance.__init__(initialize=True) # pylint: disable=unnecessary-dunder-call
+        return instance
+
+    @staticmethod
+    def default_path():
+        """State file in the state directory of the user"""
+        return os.path.join(
+            os.environ.get('XDG_STATE_HOME', os.path.expanduser('~/.local/state')),
+            'zendisplay',
+            'displays.json',
+        )
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as state_file:
+                values = json.load(state_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as exception:
+            LOG.warning('Ignoring display state', path=self.path, error=exception)
+            return {}
+        if not isinstance(values, dict):
+            return {}
+        state = {}
+        for name, value in values.items():
+            # Earlier versions stored only the brightness
+            if not isinstance(value, dict):
+                value = {'brightness': value}
+            state[name] = {
+                key: item for key, item in value.items()
+                if key in self.VALID and self.VALID[key](item)
+            }
+        return state
+
+    def get(self, name, key='brightness'):
+        """Value remembered for a display, None if unknown"""
+        with self.lock:
+            return self.values.get(name, {}).get(key)
+
+    def set(self, name, value, key='brightness'):
+        """Remember a value for a display"""
+        with self.lock:
+            display = self.values.setdefault(name, {})
+            if display.get(key) != value:
+                display[key] = value
+                self.dirty = True
+
+    def save(self):
+        """Write the state file if anything changed"""
+        with self.lock:
+            if not self.dirty:
+                return
+            values, self.dirty = (dict(self.values), False)
+
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory, mode=0o755, exist_ok=True)
+            file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+        except OSError as exception:
+            LOG.warning('Could not save display state', path=self.path, error=exception)
+            return
+        try:
+            with os.fdopen(file_descriptor, 'w', encoding='utf-8') as state_file:
+                json.dump(values, state_file, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except OSError as exception:
+            os.unlink(temp_path)
+            LOG.warning('Could not save display state', path=self.path, error=exception)
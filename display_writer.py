@@ -0,0 +1,46 @@
+"""Write display brightness in the background"""
+import threading
+from log import get_logger
+
+LOG = get_logger('display')
+
+class DisplayWriter:
+    """Write brightness values on a worker thread, a burst of values is coalesced
+
+    Only the latest value submitted while a write is in progress gets written after it. A
+    failed write is logged and the worker goes on with the next value.
+    """
+    def __init__(self, write, name=None):
+        self.write = write
+        self.name = name
+        self.pending = None
+        self.in_flight = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name=f'writer {name}', daemon=True)
+        self.thread.start()
+
+    def submit(self, brightness):
+        """Queue a value, replacing the one not yet written"""
+        with self.condition:
+            self.pending = brightness
+            self.condition.notify()
+
+    def get_target(self):
+        """Return the value being written or waiting to be written"""
+        with self.condition:
+            return self.pending if self.pending is not None else self.in_flight
+
+    def _run(self):
+        """Write pending values as they arrive"""
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                self.in_flight, self.pending = (self.pending, None)
+            try:
+                self.write(self.in_flight)
+            except Exception as exception: # pylint: disable=broad-exception-caught
+                LOG.error('Brightness write failed', display=self.name, error=exception)
+            finally:
+                with self.condition:
+                    self.in_flight = None
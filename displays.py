@@ -1,9 +1,17 @@
 """Manage displays available in the system"""
+import time
+from zendisplay_config import Config
+from display_profile import DisplayProfile
+from display_state import DisplayState
+from metrics import Metrics
+
 class DisplayManager:
     """Manage all displays in the system"""
     def __init__(self):
         self.iter_id = 0
         self.displays = []
+        Config().subscribe(self.configure, ('display',))
+        Metrics().add_collector(self._collect_metrics)
 
     def __iter__(self):
         self.iter_id = 0
@@ -22,6 +30,11 @@ class DisplayManager:
     def __len__(self):
         return len(self.displays)
 
+    def configure(self, _config):
+        """Reload the profile of every display"""
+        for display in self.displays:
+            display.profile.configure()
+
     def add_displays_type(self, display_class, parameters=None):
         """Find all displays of the given type connected to the system"""
         return [self.add_display(display) for display in display_class.detect(parameters)]
@@ -29,6 +42,7 @@ class DisplayManager:
     def add_display(self, display):
         """Add a new source"""
         display.uid = len(self.displays)
+        display.profile = DisplayProfile.from_config(display.name)
         self.displays.append(display)
         return display.uid
 
@@ -44,7 +58,49 @@ class DisplayManager:
     def set_brightness(self, brightness):
         """Set brightness for displays"""
         for display in self.displays:
-            display.set_brightness(brightness)
+            display.set_brightness(display.profile.apply(brightness))
+
+    def update_brightness(self, recommend, force=False):
+        """Calculate targets for every display due for an update, then apply them
+
+        The recommend callback receives the current brightness and the profile of a display
+        and returns the new brightness or None if the display should not change. Forced
+        updates skip the schedule and the write budget of the displays.
+        """
+        now = time.monotonic()
+        targets = {}
+        for display in self.displays:
+            if not display.enabled or not (force or display.profile.is_due(now)):
+                continue
+            display.profile.last_update = now
+            target = recommend(display.get_target_brightness(), display.profile)
+            if target is not None:
+                targets[display.uid] = target
+
+        with Metrics().timer('tick_phase_seconds', phase='display_write'):
+            for uid, target in targets.items():
+                self.displays[uid].set_brightness(target)
+                self.displays[uid].profile.budget.consume(forced=force)
+        # Written brightness values and learned timings are saved as they change and at exit
+        DisplayState().save()
+        return targets
+
+    def get_write_counters(self):
+        """Return the write counters of every display"""
+        return {
+            display.name: dict(display.profile.budget.counters) for display in self.displays
+        }
+
+    def _collect_metrics(self):
+        """Write counters and brightness of every display"""
+        for display in self.displays:
+            labels = {'display': display.name}
+            for counter in ('writes', 'forced_writes', 'deferred'):
+                yield (f'display_{counter}_total', labels, display.profile.budget.counters[counter])
+            # Runs on the scrape thread, the display is not asked
+            brightness = display.get_cached_brightness() if display.enabled else None
+            if brightness is not None:
+                yield ('display_brightness_percent', labels, brightness)
 
     def set_active(self, display_id, active):
         """Include/exclude display in the used displays list"""
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Run the control loop against emulated displays, sensors and MQTT broker
+
+Nothing is read from or written to real hardware or the user's configuration, so the full
+main_control path can be exercised and timed on any Linux machine.
+"""
+import os
+import sys
+import time
+import shlex
+import argparse
+import tempfile
+import statistics
+
+def set_displays(directory, count, latency=0.0, failure_rate=0.0, drift=0):
+    """Emulate count displays on I2C buses 1 to count, for ddcutil and as device files"""
+    # pylint: disable=import-outside-toplevel
+    from emulator_ddcutil import STATE_VARIABLE, write_state
+
+    state = os.path.join(directory, 'ddcutil.json')
+    write_state(state, {
+        bus: {
+            'name': f'EMU:Display {bus}:{bus}',
+            'latency': latency,
+            'failure_rate': failure_rate,
+            'drift': drift,
+        }
+        for bus in range(1, count + 1)
+    })
+    os.environ[STATE_VARIABLE] = state
+
+    devices = os.path.join(directory, 'dev')
+    os.makedirs(devices, exist_ok=True)
+    for name in os.listdir(devices):
+        os.unlink(os.path.join(devices, name))
+    for bus in range(1, count + 1):
+        with open(os.path.join(devices, f'i2c-{bus}'), 'wb'):
+            pass
+
+
+MQTT_SENSOR_TOPIC = 'emulated/{}/illuminance'
+
+def configure(
+        directory, interval=0.0, mqtt_port=None, display_backend='ddcutil', mqtt_sensors=False,
+):
+    """Point the configuration at the emulators, MQTT sensors replace the IIO ones"""
+    # Read the configuration and state from the emulation directory instead of the user's
+    os.environ['XDG_CONFIG_HOME'] = os.path.join(directory, 'config')
+    os.environ['XDG_STATE_HOME'] = os.path.join(directory, 'state')
+    # pylint: disable=import-outside-toplevel
+    from zendisplay_config import Config
+    from display_i2c import DisplayI2C
+    from emulator_i2c import EmulatorI2CDevice
+
+    DisplayI2C.DEVICE = EmulatorI2CDevice
+
+    emulator = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emulator_ddcutil.py')
+    options = {
+        ('general', 'ddcutil_path'): shlex.join((sys.executable, emulator)),
+        ('general', 'iio_path'): os.path.join(directory, 'iio'),
+        ('general', 'i2c_path'): os.path.join(directory, 'dev'),
+        ('general', 'display_backends'): display_backend,
+        ('general', 'sensor_backends'): 'iio',
+        ('general', 'watch_config'): 'False',
+        ('general', 'autosave'): 'False',
+        ('display', 'interval'): str(interval),
+    }
+    if mqtt_port is not None:
+        options.update({
+            ('mqtt', 'host'): '127.0.0.1',
+            ('mqtt', 'port'): str(mqtt_port),
+            ('mqtt', 'publish'): 'True',
+        })
+    if mqtt_port is not None and mqtt_sensors:
+        options.update({
+            ('general', 'sensor_backends'): 'mqtt',
+            ('mqtt', 'publish'): 'False',
+            ('mqtt', 'subscribe'): 'True',
+            ('mqtt', 'topic'): MQTT_SENSOR_TOPIC.format('+'),
+        })
+    for (section, option), value in options.items():
+        Config().set(section, option, value)
+
+
+def main():
+    """Run the emulated control loop and report tick durations"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--displays', type=int, default=2, help='number of emulated displays')
+    parser.add_argument('--backend', choices=('ddcutil', 'i2c'), default='ddcutil',
+                        help='display backend to emulate')
+    parser.add_argument('--latency', type=float, default=0.05, help='DDC latency in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='DDC failure rate')
+    parser.add_argument('--drift', type=int, default=0, help='brightness read error')
+    parser.add_argument('--ticks', type=int, default=100, help='control ticks to run')
+    parser.add_argument('--interval', type=float, default=0.0, help='display update interval')
+    parser.add_argument('--tick-time', type=float, default=0.0, help='sleep between ticks')
+    parser.add_argument('--trace', help='luminance trace as a recorder or CSV file')
+    parser.add_argument('--mqtt', action='store_true', help='publish through a stub broker')
+    parser.add_argument('--mqtt-sensors', type=int, default=0,
+                        help='sensors publishing to a stub broker instead of IIO sensors')
+    args = parser.parse_args()
+
+    # pylint: disable=import-outside-toplevel
+    from emulator_iio import EmulatorIIO
+    from emulator_mqtt import EmulatorMQTT
+    from simulate import load_trace, synthetic_trace
+
+    with tempfile.TemporaryDirectory(prefix='zendisplay-emulator-') as directory:
+        broker = None
+        if args.mqtt or args.mqtt_sensors > 0:
+            broker = EmulatorMQTT()
+            broker.start()
+        set_displays(directory, args.displays, args.latency, args.failure_rate, args.drift)
+        configure(
+            directory, args.interval, broker.port if broker is not None else None, args.backend,
+            args.mqtt_sensors > 0,
+        )
+
+        _, luminance = load_trace(args.trace) if args.trace else \
+            synthetic_trace(24, 1 / 60)
+        sensors = EmulatorIIO(os.path.join(directory, 'iio'), {'emulated-als': luminance})
+
+        from zendisplay_base import ZenDisplay
+        zendisplay = ZenDisplay()
+        if broker is not None:
+            _wait_mqtt(zendisplay)
+        durations = []
+        for tick in range(args.ticks):
+            sensors.step()
+            _publish_rooms(broker, args.mqtt_sensors, luminance[tick % len(luminance)])
+            start = time.perf_counter()
+            zendisplay.main_control()
+            durations.append(time.perf_counter() - start)
+            time.sleep(args.tick_time)
+
+        _report(durations, zendisplay, broker)
+        if broker is not None:
+            broker.stop()
+
+
+def _wait_mqtt(zendisplay, timeout=10.0):
+    """Enable publishing, which is off until enabled in the menu, and wait for the broker"""
+    deadline = time.monotonic() + timeout
+    while zendisplay.backends.is_detecting() and time.monotonic() < deadline:
+        zendisplay.backends.poll_late()
+        time.sleep(0.01)
+    for index, display in enumerate(zendisplay.displays):
+        if display.name == 'mqtt':
+            zendisplay.displays.set_active(index, True)
+    while not zendisplay.sensors.is_ready() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def _publish_rooms(broker, rooms, luminance):
+    """Publish a reading for every emulated MQTT sensor"""
+    for room in range(rooms):
+        # Rooms see the same light at different levels
+        value = luminance * (0.5 + room / rooms)
+        broker.publish(MQTT_SENSOR_TOPIC.format(f'room-{room}'), str(round(value)).encode())
+
+
+def _report(durations, zendisplay, broker):
+    """Print tick durations, device writes and the metrics"""
+    from metrics import Metrics # pylint: disable=import-outside-toplevel
+    durations.sort()
+    print(f'# ticks {len(durations)}')
+    print(f'# tick mean {statistics.mean(durations) * 1000:.3f} ms')
+    print(f'# tick p95 {durations[int(len(durations) * 0.95)] * 1000:.3f} ms')
+    print(f'# tick max {durations[-1] * 1000:.3f} ms')
+    for name, counters in zendisplay.displays.get_write_counters().items():
+        print(f'# {name} writes {counters["writes"]} forced {counters["forced_writes"]}')
+    if broker is not None:
+        print(f'# mqtt messages {len(broker.messages)}')
+    print(Metrics().render(), end='')
+
+
+if __name__ == '__main__':
+    main()
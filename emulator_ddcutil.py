@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Emulate the ddcutil command line for displays that do not exist
+
+Displays are described by a JSON state file named by the ZENDISPLAY_DDCUTIL_STATE
+environment variable, mapping I2C bus numbers to display settings:
+
+    {"3": {"name": "DEL:U2720Q:1", "brightness": 50, "latency": 0.05,
+           "failure_rate": 0.01, "drift": 1, "min_multiplier": 0.5}}
+
+Every command sleeps for the latency of its bus scaled by the sleep multiplier and fails with
+the given probability, or always if the multiplier is below min_multiplier. Reads report the
+brightness off by up to drift, as monitors adjusting their OSD values do.
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import random
+
+STATE_VARIABLE = 'ZENDISPLAY_DDCUTIL_STATE'
+DEFAULTS = {
+    'brightness': 50, 'latency': 0.0, 'failure_rate': 0.0, 'drift': 0, 'min_multiplier': 0.0,
+}
+
+def write_state(path, displays):
+    """Create the state file for the given bus to settings mapping"""
+    with open(path, 'w', encoding='utf-8') as state_file:
+        json.dump(
+            {str(bus): {**DEFAULTS, **settings} for bus, settings in displays.items()},
+            state_file,
+        )
+
+
+def load_state(path):
+    """Read the state file, the lock is not held while commands wait for their latency"""
+    with open(path, encoding='utf-8') as state_file:
+        fcntl.flock(state_file, fcntl.LOCK_SH)
+        return json.load(state_file)
+
+
+def store_brightness(path, bus, brightness):
+    """Save the brightness of one display"""
+    with open(path, 'r+', encoding='utf-8') as state_file:
+        fcntl.flock(state_file, fcntl.LOCK_EX)
+        displays = json.load(state_file)
+        displays[bus]['brightness'] = brightness
+        state_file.seek(0)
+        state_file.truncate()
+        json.dump(displays, state_file)
+
+
+def _detect(displays):
+    for number, (bus, settings) in enumerate(sorted(displays.items()), start=1):
+        print(f'Display {number}')
+        print(f'   I2C bus:  /dev/i2c-{bus}')
+        print(f'   Monitor:  {settings["name"]}')
+        print()
+    return 0
+
+
+def _vcp(displays, bus, command, arguments, multiplier=1.0):
+    """Read or write VCP feature 0x10, the brightness"""
+    settings = displays.get(bus)
+    if settings is None:
+        print(f'No monitor detected on bus /dev/i2c-{bus}', file=sys.stderr)
+        return 1
+
+    time.sleep(settings['latency'] * multiplier)
+    if random.random() < settings['failure_rate'] or multiplier < settings['min_multiplier']:
+        print('DDCRC_RETRIES(-3007): Maximum retries exceeded', file=sys.stderr)
+        return 1
+
+    if command == 'getvcp':
+        drift = random.randint(-settings['drift'], settings['drift'])
+        value = max(min(100, settings['brightness'] + drift), 0)
+        print(f'VCP {arguments[0][2:].upper()} C {value} 100')
+    else:
+        settings['brightness'] = int(arguments[1])
+    return 0
+
+
+def main(arguments):
+    """Run a ddcutil command against the state file"""
+    arguments = [argument for argument in arguments if argument != '--brief']
+    options = {}
+    for option in ('--bus', '--sleep-multiplier'):
+        if option in arguments:
+            index = arguments.index(option)
+            options[option] = arguments[index + 1]
+            del arguments[index:index + 2]
+    bus = options.get('--bus')
+    if not bool(arguments):
+        return 1
+
+    path = os.environ[STATE_VARIABLE]
+    displays = load_state(path)
+    if arguments[0] == 'detect':
+        return _detect(displays)
+    if arguments[0] not in ('getvcp', 'setvcp'):
+        return 1
+
+    multiplier = float(options.get('--sleep-multiplier', 1.0))
+    status = _vcp(displays, bus, arguments[0], arguments[1:], multiplier)
+    if arguments[0] == 'setvcp' and status == 0:
+        store_brightness(path, bus, displays[bus]['brightness'])
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,86 @@
+"""Emulate I2C buses with displays answering DDC/CI"""
+import os
+import time
+import errno
+import random
+from functools import reduce
+from emulator_ddcutil import STATE_VARIABLE, load_state, store_brightness
+
+def _checksum(initial, data):
+    return reduce(lambda checksum, byte: checksum ^ byte, data, initial)
+
+
+def _edid(name):
+    """EDID block with the manufacturer, model and serial of a ddcutil style name"""
+    manufacturer, model, serial = (name.split(':') + ['', ''])[:3]
+    vendor = 0
+    for letter in manufacturer[:3].upper().ljust(3, 'A'):
+        vendor = vendor << 5 | (ord(letter) - 64) & 0x1f
+    edid = bytearray(128)
+    edid[:8] = b'\x00\xff\xff\xff\xff\xff\xff\x00'
+    edid[8:10] = vendor.to_bytes(2, 'big')
+    for offset, tag, text in ((54, 0xfc, model), (72, 0xff, serial)):
+        edid[offset + 3] = tag
+        edid[offset + 5:offset + 18] = (text.encode('ascii')[:12] + b'\x0a').ljust(13, b' ')
+    edid[127] = -sum(edid[:127]) & 0xff
+    return bytes(edid)
+
+
+class EmulatorI2CDevice:
+    """Stand-in for I2CDevice answering like the display in the ddcutil emulator state
+
+    Create empty files named i2c-N in a directory, set general.i2c_path to it and
+    DisplayI2C.DEVICE to this class. Displays are read from the ZENDISPLAY_DDCUTIL_STATE
+    file with their latency, failure rate and drift. Requests sent sooner than min_multiplier
+    times the DDC/CI write delay after the previous one are answered with a null message.
+    """
+    WRITE_DELAY = 0.05
+    def __init__(self, path):
+        self.path = path
+        self.bus = os.path.basename(path).split('-', 1)[1]
+        self.state_path = os.environ[STATE_VARIABLE]
+        self.settings = load_state(self.state_path).get(self.bus)
+        if self.settings is None:
+            raise OSError(errno.ENXIO, 'No device on bus', path)
+        self.address = None
+        self.reply = b''
+        self.last_request = None
+
+    def select(self, address):
+        """Address the following reads and writes to the given device"""
+        self.address = address
+
+    def write(self, data):
+        """Handle an EDID offset or a DDC/CI request"""
+        if self.address == 0x50:
+            self.reply = _edid(self.settings['name'])[data[0]:]
+            return
+        time.sleep(self.settings['latency'])
+        if random.random() < self.settings['failure_rate']:
+            raise OSError(errno.EIO, 'Remote I/O error', self.path)
+        now = time.monotonic()
+        early = self.last_request is not None and \
+            now - self.last_request < self.WRITE_DELAY * self.settings['min_multiplier']
+        self.last_request = now
+        if early or _checksum(0x6e, data[:-1]) != data[-1]:
+            self.reply = b'\x6e\x80\xbe'
+            return
+
+        opcode, code = (data[2], data[3])
+        if opcode == 0x03:
+            self.settings['brightness'] = int.from_bytes(data[4:6], 'big')
+            store_brightness(self.state_path, self.bus, self.settings['brightness'])
+        elif opcode == 0x01:
+            drift = random.randint(-self.settings['drift'], self.settings['drift'])
+            value = max(min(100, self.settings['brightness'] + drift), 0)
+            unsupported = int(code != 0x10)
+            message = bytes((0x6e, 0x88, 0x02, unsupported, code, 0x00, 0x00, 100, 0x00, value))
+            self.reply = message + bytes((_checksum(0x50, message),))
+
+    def read(self, count):
+        """Return the pending reply"""
+        reply, self.reply = (self.reply[:count], b'')
+        return reply
+
+    def close(self):
+        """Nothing to release"""
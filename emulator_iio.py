@@ -0,0 +1,50 @@
+"""Emulate sysfs IIO illuminance sensors replaying a luminance trace"""
+import os
+import time
+import threading
+
+class EmulatorIIO:
+    """Device tree in the layout of /sys/bus/iio/devices with one sensor per trace
+
+    Set general.iio_path to the root of the tree to detect the sensors.
+    """
+    def __init__(self, root, traces, rate=1.0):
+        self.root = root
+        self.traces = traces
+        self.rate = rate
+        self.position = 0
+        self.stopped = threading.Event()
+        self.thread = None
+        for index, name in enumerate(traces):
+            device = os.path.join(root, f'iio:device{index}')
+            os.makedirs(device, exist_ok=True)
+            with open(os.path.join(device, 'name'), 'w', encoding='utf-8') as name_file:
+                name_file.write(f'{name}\n')
+        self.step()
+
+    def step(self):
+        """Publish the next value of every trace, traces start over when they end"""
+        for index, trace in enumerate(self.traces.values()):
+            path = os.path.join(self.root, f'iio:device{index}', 'in_illuminance_raw')
+            with open(f'{path}.tmp', 'w', encoding='utf-8') as value_file:
+                value_file.write(f'{round(trace[self.position % len(trace)])}\n')
+            os.replace(f'{path}.tmp', path)
+        self.position += 1
+
+    def start(self):
+        """Replay the traces at rate values per second on a background thread"""
+        self.thread = threading.Thread(target=self._run, name='emulator-iio', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop replaying"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        deadline = time.monotonic()
+        while not self.stopped.is_set():
+            deadline += 1 / self.rate
+            self.stopped.wait(max(deadline - time.monotonic(), 0))
+            self.step()
@@ -0,0 +1,178 @@
+"""Minimal MQTT 3.1.1 broker for running the MQTT backends without a server
+
+Only what the backends use is supported: QoS 0 and 1 publishing, subscriptions with
+wildcards, retained messages and keep alive pings. Messages are delivered with QoS 0.
+"""
+import socket
+import struct
+import threading
+import socketserver
+
+CONNECT, CONNACK, PUBLISH, PUBACK = (1, 2, 3, 4)
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = (8, 9, 10, 11)
+PINGREQ, PINGRESP, DISCONNECT = (12, 13, 14)
+
+def topic_matches(pattern, topic):
+    """Return whether a topic matches a subscription with + and # wildcards"""
+    pattern_levels, topic_levels = (pattern.split('/'), topic.split('/'))
+    for index, level in enumerate(pattern_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels) or level not in ('+', topic_levels[index]):
+            return False
+    return len(pattern_levels) == len(topic_levels)
+
+
+def _string(data, offset):
+    """Decode a length prefixed UTF-8 string, return it with the offset after it"""
+    length = struct.unpack_from('!H', data, offset)[0]
+    return (data[offset + 2:offset + 2 + length].decode('utf-8'), offset + 2 + length)
+
+
+def _packet(packet_type, body, flags=0):
+    """Encode a packet with its fixed header"""
+    header = bytearray([packet_type << 4 | flags])
+    length = len(body)
+    while True:
+        byte, length = (length % 128, length // 128)
+        header.append(byte | (0x80 if length > 0 else 0))
+        if length == 0:
+            return bytes(header) + body
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """Serve one client connection"""
+    def setup(self):
+        self.subscriptions = set()
+        self.send_lock = threading.Lock()
+
+    def send(self, data):
+        """Send a packet, ignoring clients that went away"""
+        with self.send_lock:
+            try:
+                self.request.sendall(data)
+            except OSError:
+                pass
+
+    def _read(self, count):
+        data = b''
+        while len(data) < count:
+            chunk = self.request.recv(count - len(data))
+            if not bool(chunk):
+                raise ConnectionError()
+            data += chunk
+        return data
+
+    def _read_packet(self):
+        first = self._read(1)[0]
+        length, multiplier = (0, 1)
+        while True:
+            byte = self._read(1)[0]
+            length += (byte & 0x7f) * multiplier
+            multiplier *= 128
+            if byte & 0x80 == 0:
+                break
+        return (first >> 4, first & 0x0f, self._read(length))
+
+    def handle(self):
+        self.server.clients.add(self)
+        try:
+            while True:
+                packet_type, flags, body = self._read_packet()
+                if packet_type == DISCONNECT:
+                    break
+                self._dispatch(packet_type, flags, body)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.server.clients.discard(self)
+
+    def _dispatch(self, packet_type, flags, body):
+        if packet_type == CONNECT:
+            self.send(_packet(CONNACK, b'\x00\x00'))
+        elif packet_type == PINGREQ:
+            self.send(_packet(PINGRESP, b''))
+        elif packet_type == PUBLISH:
+            topic, offset = _string(body, 0)
+            qos = (flags >> 1) & 0x03
+            if qos > 0:
+                self.send(_packet(PUBACK, body[offset:offset + 2]))
+                offset += 2
+            self.server.publish(topic, body[offset:], retain=bool(flags & 0x01))
+        elif packet_type in (SUBSCRIBE, UNSUBSCRIBE):
+            self._subscribe(packet_type, body)
+
+    def _subscribe(self, packet_type, body):
+        offset, patterns = (2, [])
+        while offset < len(body):
+            pattern, offset = _string(body, offset)
+            offset += 1 if packet_type == SUBSCRIBE else 0
+            patterns.append(pattern)
+
+        if packet_type == UNSUBSCRIBE:
+            self.subscriptions.difference_update(patterns)
+            self.send(_packet(UNSUBACK, body[:2]))
+            return
+        self.subscriptions.update(patterns)
+        self.send(_packet(SUBACK, body[:2] + b'\x00' * len(patterns)))
+        for topic, payload in list(self.server.retained.items()):
+            if any(topic_matches(pattern, topic) for pattern in patterns):
+                self.send(self.server.message(topic, payload, retain=True))
+
+
+class EmulatorMQTT(socketserver.ThreadingTCPServer):
+    """Broker listening on localhost, port 0 picks a free port
+
+    Every published message is kept in messages for inspection.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.clients = set()
+        self.retained = {}
+        self.messages = []
+        self.thread = None
+
+    @property
+    def port(self):
+        """Port the broker listens on"""
+        return self.server_address[1]
+
+    @staticmethod
+    def message(topic, payload, retain=False):
+        """Encode a QoS 0 publish packet"""
+        encoded = topic.encode('utf-8')
+        return _packet(PUBLISH, struct.pack('!H', len(encoded)) + encoded + payload, int(retain))
+
+    def publish(self, topic, payload, retain=False):
+        """Deliver a message to the matching subscribers"""
+        self.messages.append((topic, payload, retain))
+        if retain:
+            if bool(payload):
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        packet = self.message(topic, payload)
+        for client in list(self.clients):
+            if any(topic_matches(pattern, topic) for pattern in client.subscriptions):
+                client.send(packet)
+
+    def disconnect_clients(self):
+        """Drop every client connection, as a restarting broker would"""
+        for client in list(self.clients):
+            try:
+                client.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def start(self):
+        """Serve on a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever, name='emulator-mqtt', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,112 @@
+"""Logging with structured fields, rate limiting and per tick tracing"""
+import sys
+import time
+import logging
+from contextlib import contextmanager
+
+ROOT_LOGGER = 'zendisplay'
+KEY_FIELDS = ('display', 'bus', 'backend', 'sensor')
+
+class StructuredLogger(logging.LoggerAdapter):
+    """Logger taking structured fields as keyword arguments"""
+    RESERVED = ('exc_info', 'stack_info', 'stacklevel', 'extra')
+
+    def process(self, msg, kwargs):
+        ratelimit = kwargs.pop('ratelimit', True)
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in self.RESERVED}
+        kwargs['extra'] = {**kwargs.get('extra', {}), 'fields': fields, 'ratelimit': ratelimit}
+        return msg, kwargs
+
+
+class StructuredFormatter(logging.Formatter):
+    """Append structured fields to the message as key=value pairs"""
+    def format(self, record):
+        message = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if bool(fields):
+            message += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return message
+
+
+# pylint: disable-next=too-few-public-methods
+class RateLimitFilter(logging.Filter):
+    """Let through at most burst messages of a kind per interval
+
+    Messages are of the same kind if they have the same logger, text and key fields.
+    The number of suppressed messages is reported with the next message let through.
+    """
+    def __init__(self, interval=60.0, burst=5):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.windows = {}
+
+    def filter(self, record):
+        if self.interval <= 0 or getattr(record, 'ratelimit', True) is False:
+            return True
+        fields = getattr(record, 'fields', None) or {}
+        key = (
+            record.name, record.levelno, record.msg,
+            tuple(fields.get(field) for field in KEY_FIELDS),
+        )
+        now = time.monotonic()
+        start, count, suppressed = self.windows.get(key, (now, 0, 0))
+        if now - start >= self.interval:
+            start, count = (now, 0)
+
+        if count >= self.burst:
+            self.windows[key] = (start, count, suppressed + 1)
+            return False
+
+        if suppressed > 0:
+            record.fields = {**fields, 'suppressed': suppressed}
+        self.windows[key] = (start, count + 1, 0)
+        return True
+
+
+class Trace:
+    """Durations of the named spans of one control tick"""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = {}
+
+    @contextmanager
+    def span(self, name):
+        """Add the duration of the block to the span"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + time.perf_counter() - start
+
+    def fields(self):
+        """Span durations in milliseconds"""
+        return {
+            **{name: f'{duration * 1000:.2f}ms' for name, duration in self.spans.items()},
+            'total': f'{(time.perf_counter() - self.start) * 1000:.2f}ms',
+        }
+
+
+def get_logger(name):
+    """Return the structured logger of a module"""
+    return StructuredLogger(logging.getLogger(f'{ROOT_LOGGER}.{name}'), {})
+
+
+def setup(level='info', interval=60.0, burst=5):
+    """Configure the handler of the application logger, can be called again to reconfigure
+
+    Reconfiguring updates the rate limit in place, so the windows of recent messages are kept.
+    """
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(getattr(logging, level.upper(), logging.INFO))
+    logger.propagate = False
+    for handler in logger.handlers:
+        for log_filter in handler.filters:
+            if isinstance(log_filter, RateLimitFilter):
+                log_filter.interval, log_filter.burst = (interval, burst)
+                return
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(StructuredFormatter('%(levelname)s %(name)s: %(message)s'))
+    handler.addFilter(RateLimitFilter(interval, burst))
+    logger.addHandler(handler)
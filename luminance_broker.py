@@ -0,0 +1,88 @@
+"""Get ambient lighting from the sensor broker shared by every session"""
+import time
+from sensor_broker import SharedReadings
+from base_classes import LuminanceSource
+from log import get_logger
+
+LOG = get_logger('broker')
+
+class LuminanceBroker(LuminanceSource):
+    """Read a sensor sampled by the broker from shared memory, without touching the hardware
+
+    The sensor is ready while the broker keeps publishing. If the broker restarted with a
+    new file, the file is mapped again.
+    """
+    # Sampling intervals the broker may miss before its readings are not used
+    MISSED_SAMPLES = 3
+
+    def __init__(self, name=None, path=None, readings=None):
+        super().__init__(name, path)
+        self.readings = readings
+        self.reading = None
+
+    @classmethod
+    def detect(cls, parameters=None):
+        """Add every sensor published by a running broker"""
+        path = SharedReadings.default_path()
+        try:
+            readings = SharedReadings(path)
+        except (OSError, ValueError) as exception:
+            LOG.debug('No sensor broker', path=path, error=exception)
+            return
+        snapshot = readings.read()
+        if snapshot is None:
+            return
+        for name in snapshot.readings:
+            yield cls(name=name, path=path, readings=readings)
+
+    def _is_stale(self, snapshot):
+        """Return whether the broker stopped publishing"""
+        return snapshot is None or \
+            time.monotonic() - snapshot.published > snapshot.interval * self.MISSED_SAMPLES
+
+    def _read(self):
+        """Current reading of the sensor, None if the broker is not publishing it"""
+        snapshot = self.readings.read()
+        if self._is_stale(snapshot) and self._reopen():
+            snapshot = self.readings.read()
+        if self._is_stale(snapshot):
+            return None
+        reading = snapshot.readings.get(self.name)
+        if reading is None or not reading.ready:
+            return None
+        return reading
+
+    def _reopen(self):
+        """Map the file of a restarted broker, return whether it was mapped"""
+        if not self.readings.is_replaced():
+            return False
+        try:
+            readings = SharedReadings(self.path)
+        except (OSError, ValueError):
+            return False
+        LOG.info('Sensor broker restarted', sensor=self.name)
+        # The old mapping may still be used by other sensors of the broker
+        self.readings = readings
+        return True
+
+    def is_ready(self):
+        """Return whether the broker published a recent reading of the sensor"""
+        reading = self._read()
+        if reading is not None:
+            self.reading = reading
+        return reading is not None
+
+    def get_luminance(self):
+        """Get the last luminance published by the broker"""
+        reading = self._read()
+        if reading is not None:
+            self.reading = reading
+        if self.reading is None:
+            return 0
+        return round(self.reading.value)
+
+    def get_age(self):
+        """Seconds since the broker read the sensor"""
+        if self.reading is None:
+            return None
+        return time.monotonic() - self.reading.updated
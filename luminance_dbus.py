@@ -1,16 +1,35 @@
 """Get ambient lighting data through dbus from iio-sensor-proxy"""
-from threading import Timer
+import time
 import dbus
 from dbus_object import DBusObject
 from base_classes import LuminanceSource
+from zendisplay_config import Config
+from log import get_logger
 
+LOG = get_logger('iio-sensor-proxy')
+
+# pylint: disable-next=too-many-instance-attributes
 class LuminanceDBus(LuminanceSource):
-    """Get ambient lighting information from iio-sensor-proxy via dbus"""
+    """Get ambient lighting information from iio-sensor-proxy via dbus
+
+    The sensor is ready on the first reading, from a PropertiesChanged signal or from
+    reading the properties right after claiming the sensor. Calls are asynchronous on the
+    main loop, failed reads are retried from is_ready a limited number of times.
+    """
+    RETRIES = 5
+    RETRY_DELAY = 0.5
+    UNIT_PROPERTY = 'LightLevelUnit'
+    UNIT_LUX = 'lux'
+
     def __init__(self, name=None, path=None):
         super().__init__(name, path)
         self.luminance = 0
         self.luminance_prop = 'LightLevel'
-        self.appear_timer = None
+        self.unit = self.UNIT_LUX
+        # Replies of an earlier connection of the sensor are ignored
+        self.connection = 0
+        self.retries = 0
+        self.retry_at = None
 
         # Configure DBus connection
         self.bus = dbus.SystemBus()
@@ -29,29 +48,91 @@ class LuminanceDBus(LuminanceSource):
         """Get last luminance data received"""
         return self.luminance
 
+    def is_ready(self):
+        """Return whether a reading arrived, retry a failed read when it is due"""
+        if not super().is_ready() and self.retry_at is not None and \
+                time.monotonic() >= self.retry_at:
+            self.retry_at = None
+            self._claim(self.connection)
+        return super().is_ready()
+
     def sensor_connect(self):
         """Attach sensor"""
-        print(f'{self.name} appeared')
+        LOG.info('Sensor appeared', sensor=self.name)
+        self.connection += 1
+        self.retries = 0
         self.sensor.watch_properties(self.handle_sensor_proxy_signal)
-        self.sensor.interface().ClaimLight()
-        self.appear_timer = Timer(1.0, self.sensor_read)
-        self.appear_timer.start()
+        self._claim(self.connection)
+
+    def _claim(self, connection):
+        """Claim the sensor and read the light level and its unit, without waiting for replies
+
+        Claiming again is harmless, so retries start over from the claim.
+        """
+        self.sensor.interface().ClaimLight(
+            reply_handler=lambda: self._request_properties(connection),
+            error_handler=lambda error: self._read_failed(connection, error),
+        )
+
+    def _request_properties(self, connection):
+        if connection != self.connection:
+            return
+        self.sensor.get_properties(
+            reply_handler=lambda properties: self._properties_read(connection, properties),
+            error_handler=lambda error: self._read_failed(connection, error),
+        )
+
+    def _properties_read(self, connection, properties):
+        if connection != self.connection:
+            return
+        if not super().is_ready() and not properties.get('HasAmbientLight', True):
+            self._read_failed(connection, 'No ambient light sensor')
+            return
+        unit = str(properties.get(self.UNIT_PROPERTY, self.UNIT_LUX))
+        # A reading from a signal is kept unless it was converted with another unit
+        keep_reading = super().is_ready() and unit == self.unit
+        self._set_unit(unit)
+        if not keep_reading:
+            self._set_luminance(properties[self.luminance_prop])
+
+    def _read_failed(self, connection, error):
+        """Schedule another read until the retries run out"""
+        if connection != self.connection:
+            return
+        self.retries += 1
+        if self.retries > self.RETRIES:
+            LOG.warning('Sensor not readable', sensor=self.name, error=error)
+            return
+        LOG.debug('Sensor read failed', sensor=self.name, error=error, retry=self.retries)
+        self.retry_at = time.monotonic() + self.RETRY_DELAY
+
+    def _set_unit(self, unit):
+        if unit != self.unit:
+            LOG.info('Sensor unit changed', sensor=self.name, unit=unit)
+        self.unit = str(unit)
 
-    def sensor_read(self):
-        """Read sensor manually"""
-        self.luminance = self.sensor.get_property(self.luminance_prop)
-        self._set_ready(True)
-        print(f'{self.name} ready')
+    def _set_luminance(self, level):
+        """Store a reading, converting vendor units to lux"""
+        if self.unit != self.UNIT_LUX:
+            level *= Config().get('general', 'vendor_light_scale')
+        self.luminance = level
+        self._set_updated()
+        if not super().is_ready():
+            self.retry_at = None
+            self._set_ready(True)
+            LOG.info('Sensor ready', sensor=self.name, unit=self.unit)
 
     def sensor_disconnect(self):
         """Detach sensor"""
-        print(f'{self.name} vanished')
-        if self.appear_timer:
-            self.appear_timer.cancel()
+        LOG.info('Sensor vanished', sensor=self.name)
+        self.connection += 1
+        self.retry_at = None
         self._set_ready(False)
         self.sensor.watch_properties_stop()
 
     def handle_sensor_proxy_signal(self, _interface_name, changed_props, _invalidated_props):
         """Read luminance value from incoming DBus signal"""
+        if self.UNIT_PROPERTY in changed_props:
+            self._set_unit(changed_props[self.UNIT_PROPERTY])
         if self.luminance_prop in changed_props:
-            self.luminance = changed_props[self.luminance_prop]
+            self._set_luminance(changed_props[self.luminance_prop])
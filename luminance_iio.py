@@ -1,10 +1,11 @@
 """Get ambient lighting from IIO bus compatible sensors"""
 import os
+from zendisplay_config import Config
 from base_classes import LuminanceSource
+from metrics import Metrics
 
 class LuminanceIIO(LuminanceSource):
     """Handle ambient lighting sensors through sysfs"""
-    SYSFS_IIO_PATH = '/sys/bus/iio/devices/'
     SYSFS_IIO_ILLUMINANCE_FILE = 'in_illuminance_raw'
     SYSFS_IIO_NAME_FILE = 'name'
 
@@ -16,12 +17,13 @@ class LuminanceIIO(LuminanceSource):
     @classmethod
     def detect(cls, parameters=None):
         """Find all sensors connected to the system"""
-        directory = os.fsencode(cls.SYSFS_IIO_PATH)
+        sysfs_path = Config().get('general', 'iio_path')
+        directory = os.fsencode(sysfs_path)
         if not os.path.isdir(directory):
             return
 
         for device in os.listdir(directory):
-            device_path = os.path.join(cls.SYSFS_IIO_PATH, os.fsdecode(device))
+            device_path = os.path.join(sysfs_path, os.fsdecode(device))
             # Check if device is an illuminance sensor
             if not os.path.isfile(os.path.join(device_path, cls.SYSFS_IIO_ILLUMINANCE_FILE)):
                 continue
@@ -34,5 +36,8 @@ class LuminanceIIO(LuminanceSource):
 
     def get_luminance(self):
         """Get luminance from the sensor"""
-        with open(self.file, encoding='utf-8') as file_in:
-            return int(file_in.read().strip())
+        with Metrics().timer('backend_io_seconds', backend='iio', operation='read'):
+            with open(self.file, encoding='utf-8') as file_in:
+                luminance = int(file_in.read().strip())
+        self._set_updated()
+        return luminance
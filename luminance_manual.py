@@ -7,6 +7,8 @@ class LuminanceManual(LuminanceSource):
         super().__init__(name, path)
         self._set_ready(True)
         self.original_value = 0
+        # Whether the enable callback ran, the callbacks only run when this changes
+        self.engaged = False
         self.callbacks = {
             'enable': parameters['cb_enable'],
             'disable': parameters['cb_disable'],
@@ -25,12 +27,18 @@ class LuminanceManual(LuminanceSource):
     def enable(self):
         """Enable the source"""
         super().enable()
+        if self.engaged:
+            return
+        self.engaged = True
         self.original_value = self.__callback('get_value')
         self.__callback('enable')
 
     def disable(self):
         """Disable the source"""
         super().disable()
+        if not self.engaged:
+            return
+        self.engaged = False
         self.__callback('disable', self.original_value)
 
     def __callback(self, callback_name, *args, **kwargs):
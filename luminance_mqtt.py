@@ -1,23 +1,58 @@
 """Get or provide ambient lighting data through mqtt"""
+import json
+import math
+import time
+import socket
+import threading
+import statistics
 import paho.mqtt.client as mqtt
 from zendisplay_config import Config
 from base_classes import LuminanceSource, Display
+from metrics import Metrics
+from log import get_logger
 
+LOG = get_logger('mqtt')
+
+# pylint: disable-next=too-many-instance-attributes
 class LuminanceMQTT(LuminanceSource, Display):
-    """Get ambient lighting information from MQTT"""
+    """Get ambient lighting information from MQTT
+
+    The connection is made in the background and retried with exponential backoff. A topic
+    with wildcards aggregates the readings of several sensors, readings older than
+    stale_after are left out.
+
+    Published values are throttled to one message per publish interval, the last value of
+    a burst is sent at the end of the interval. Changes smaller than the deadband are not
+    published and with QoS above 0 no message is sent while the previous one is unacknowledged.
+    """
     PARAMETER_MQTT_HOST = 'host'
     PARAMETER_MQTT_TOPIC = 'topic'
+    # in_flight while a QoS 1 or 2 message is being handed to paho
+    PUBLISHING = object()
+    PAYLOAD_KEYS = ('value', 'brightness', 'luminance', 'illuminance', 'lux')
+    AGGREGATES = {
+        'mean': statistics.mean,
+        'median': statistics.median,
+        'min': min,
+        'max': max,
+    }
 
     def __init__(self, name=None, path=None, host=None):
         super().__init__(name, path)
         self.enabled = False
         self.luminance = 0
         self.mqtt_host = host
-        # Create MQTT client
-        self.client = mqtt.Client()
-        self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
-        self.client.on_disconnect = self.on_disconnect
+        self.settings = self._connection_settings(Config().snapshot())
+        self.lock = threading.Lock()
+        self.readings = {}
+        self.pending = None
+        self.published = None
+        self.published_at = None
+        self.in_flight = None
+        self.acknowledged = None
+        self.timer = None
+        self.client = None
+        Config().subscribe(self.configure, ('mqtt',))
 
     @classmethod
     def detect(cls, parameters):
@@ -28,34 +63,141 @@ class LuminanceMQTT(LuminanceSource, Display):
             return
         yield cls(name="mqtt", path=topic, host=host)
 
+    @staticmethod
+    def _connection_settings(config):
+        """Options that need a new connection when changed"""
+        mqtt_config = config.mqtt
+        return (
+            mqtt_config.host, mqtt_config.port, mqtt_config.keepalive,
+            mqtt_config.tls, mqtt_config.tls_ca_certs, mqtt_config.topic,
+        )
+
+    def configure(self, config):
+        """Reconnect if the server or the topic changed"""
+        settings = self._connection_settings(config)
+        if settings == self.settings:
+            return
+        enabled = self.enabled
+        if enabled:
+            self.disable()
+        self.settings = settings
+        self.mqtt_host, self.path = (config.mqtt.host, config.mqtt.topic)
+        with self.lock:
+            self.readings.clear()
+        if enabled:
+            self.enable()
+
+    @property
+    def is_wildcard(self):
+        """Return whether the topic subscribes to several sensors"""
+        return '+' in self.path or '#' in self.path
+
     def get_luminance(self):
-        """Get last luminance data received"""
+        """Aggregate the readings received recently, keep the last value if all are stale"""
+        config = Config().snapshot().mqtt
+        now = time.monotonic()
+        with self.lock:
+            if config.stale_after > 0:
+                for topic, (_, received) in list(self.readings.items()):
+                    if now - received > config.stale_after:
+                        del self.readings[topic]
+            values = [value for value, _ in self.readings.values()]
+        Metrics().set_gauge('mqtt_sensors', len(values))
+        if bool(values):
+            aggregate = self.AGGREGATES.get(config.aggregate, statistics.median)
+            self.luminance = round(aggregate(values))
         return self.luminance
 
+    def _create_client(self):
+        """Client with the callbacks, TLS and reconnect backoff configured"""
+        config = Config().snapshot().mqtt
+        client = mqtt.Client()
+        client.on_connect = self.on_connect
+        client.on_connect_fail = self.on_connect_fail
+        client.on_message = self.on_message
+        client.on_disconnect = self.on_disconnect
+        client.on_publish = self.on_publish
+        client.reconnect_delay_set(
+            config.reconnect_min_delay, max(config.reconnect_max_delay, config.reconnect_min_delay)
+        )
+        if config.tls:
+            client.tls_set(ca_certs=config.tls_ca_certs or None)
+        return client
+
     def enable(self):
-        """Enable the source"""
+        """Enable the source, connecting in the background"""
         super().enable()
-        self.client.connect(self.mqtt_host, 1883, 60)
+        self.client = self._create_client()
+        self.client.connect_async(
+            self.mqtt_host, Config().get('mqtt', 'port'), Config().get('mqtt', 'keepalive')
+        )
         self.client.loop_start()
 
     def disable(self):
         """Disable the source"""
         super().disable()
-        self.client.loop_stop(force=False)
-        self.client.disconnect()
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.in_flight = None
+        if self.client is not None:
+            self.client.disconnect()
+            self.client.loop_stop()
+        self._set_ready(False)
 
-    def on_connect(self, _1, _2, _3, _4):
+    def on_connect(self, client, _2, _3, result):
         """Called when connection is established to the MQTT server"""
-        self.client.subscribe(self.path)
+        if result != mqtt.CONNACK_ACCEPTED:
+            LOG.warning(
+                'MQTT connection refused', host=self.mqtt_host,
+                reason=mqtt.connack_string(result),
+            )
+            Metrics().count('mqtt_connect_failures_total')
+            return
+        LOG.info('MQTT connected', host=self.mqtt_host, topic=self.path)
+        client.subscribe(self.path)
         self._set_ready(True)
+        # Acknowledgements of messages sent before a reconnect will not arrive
+        with self.lock:
+            self.in_flight = None
+        self._flush()
+
+    def on_connect_fail(self, _1, _2):
+        """Called when the server can not be reached, the client retries after a delay"""
+        LOG.warning('MQTT server unreachable', host=self.mqtt_host)
+        Metrics().count('mqtt_connect_failures_total')
 
     def on_message(self, _1, _2, msg):
         """Called when message is received from the MQTT server"""
-        self.luminance = int(msg.payload)
+        value = self.parse_payload(msg.payload)
+        if value is None:
+            Metrics().count('mqtt_invalid_messages_total')
+            return
+        with self.lock:
+            self.readings[msg.topic] = (value, time.monotonic())
+        if not self.is_wildcard:
+            self.luminance = value
+        self._set_updated()
+
+    @classmethod
+    def parse_payload(cls, payload):
+        """Read a number or a JSON object with the number under one of PAYLOAD_KEYS"""
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return None
+        if isinstance(data, dict):
+            data = next((data[key] for key in cls.PAYLOAD_KEYS if key in data), None)
+        if isinstance(data, bool) or not isinstance(data, (int, float)) or \
+                not math.isfinite(data):
+            return None
+        return round(data)
 
-    def on_disconnect(self, _1, _2, reason_code, _4):
-        """Called when MQTT is disconnected"""
-        if reason_code is not mqtt.MQTT_ERR_SUCCESS:
+    def on_disconnect(self, _1, _2, reason_code, _4=None):
+        """Called when MQTT is disconnected, the client reconnects unless disabled"""
+        if reason_code != mqtt.MQTT_ERR_SUCCESS:
+            LOG.warning('MQTT connection lost', host=self.mqtt_host, reason=reason_code)
             self._set_ready(False)
 
     def get_brightness(self):
@@ -64,14 +206,100 @@ class LuminanceMQTT(LuminanceSource, Display):
             return self.luminance
         return None
 
+    def get_cached_brightness(self):
+        """The brightness is the last value received or published"""
+        return self.get_brightness()
+
     def set_brightness(self, brightness):
-        """Set brightness of the display"""
-        if brightness == self.get_brightness() or brightness < 0:
+        """Set brightness of the display, a topic with wildcards can not be published to"""
+        if brightness == self.get_brightness() or brightness < 0 or self.is_wildcard:
             return
 
         if self.enabled:
             self._set_brightness(brightness)
 
     def _set_brightness(self, brightness):
-        """Publish given data to the topic of the object"""
-        self.client.publish(self.path, brightness)
+        """Publish the brightness now or at the end of the publish interval"""
+        with self.lock:
+            self.pending = brightness
+        self._flush()
+
+    def _flush(self):
+        """Publish the pending value if the interval, the deadband and QoS allow it
+
+        paho calls on_publish holding the lock publish() needs, so publish() is called
+        without holding self.lock.
+        """
+        with self.lock:
+            message = self._take_pending()
+        if message is None:
+            return
+        value, config = message
+        info = self.client.publish(
+            self.path, self._payload(value, config.payload), config.qos, config.retain
+        )
+        Metrics().count('mqtt_publish_total')
+        if config.qos == 0:
+            return
+        with self.lock:
+            if self.in_flight is not self.PUBLISHING:
+                return
+            # The acknowledgement may arrive before publish() returns
+            acknowledged = info.mid == self.acknowledged
+            self.in_flight = None if acknowledged else info.mid
+        if acknowledged:
+            self._flush()
+
+    def _take_pending(self):
+        """Return the value to publish with the configuration, None to hold it back"""
+        if self.pending is None or self.in_flight is not None:
+            return None
+        config = Config().snapshot().mqtt
+        value = self.pending
+        if self.published is not None and value not in (0, 100) and \
+                abs(value - self.published) < config.publish_deadband:
+            self.pending = None
+            Metrics().count('mqtt_publish_skipped_total', reason='deadband')
+            return None
+
+        now = time.monotonic()
+        if self.published_at is not None and now - self.published_at < config.publish_interval:
+            if self.timer is None:
+                self.timer = threading.Timer(
+                    self.published_at + config.publish_interval - now, self._on_timer
+                )
+                self.timer.daemon = True
+                self.timer.start()
+            Metrics().count('mqtt_publish_skipped_total', reason='coalesced')
+            return None
+
+        self.pending = None
+        self.published, self.published_at = (value, now)
+        if config.qos > 0:
+            self.in_flight, self.acknowledged = (self.PUBLISHING, None)
+        return (value, config)
+
+    def _payload(self, value, payload_format):
+        if payload_format == 'json':
+            return json.dumps({'value': value, 'timestamp': time.time(), 'source': self.source})
+        return str(value)
+
+    @property
+    def source(self):
+        """Name of this instance in JSON payloads"""
+        return f'{socket.gethostname()}/{self.name}'
+
+    def _on_timer(self):
+        with self.lock:
+            self.timer = None
+        self._flush()
+
+    def on_publish(self, _1, _2, mid):
+        """Called when the server acknowledged a message, sends the value held back"""
+        with self.lock:
+            if mid != self.in_flight:
+                if self.in_flight is self.PUBLISHING:
+                    self.acknowledged = mid
+                return
+            self.in_flight = None
+        self._flush()
@@ -28,10 +28,15 @@ class LuminanceSourceManager:
         for source in source_class.detect(parameters):
             self.add_source(source)
 
-    def add_source(self, source):
-        """Add a new source"""
-        source.uid = len(self.sensors)
-        self.sensors.append(source)
+    def add_source(self, source, index=None):
+        """Add a new source, before the source at the given index if there is one"""
+        if index is None:
+            index = len(self.sensors)
+        self.sensors.insert(index, source)
+        if len(self.sensors) > 1 and index <= self.active:
+            self.active += 1
+        for uid, sensor in enumerate(self.sensors):
+            sensor.uid = uid
         return source.uid
 
     def get_luminance(self):
@@ -44,7 +49,8 @@ class LuminanceSourceManager:
 
     def activate(self, sensor_id):
         """Use the source with the given ID"""
-        self.sensors[self.active].disable()
+        if sensor_id != self.active:
+            self.sensors[self.active].disable()
         self.active = sensor_id
         self.sensors[self.active].enable()
 
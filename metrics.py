@@ -0,0 +1,165 @@
+"""Collect control loop and device I/O metrics in the Prometheus text format"""
+import os
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from log import get_logger
+
+LOG = get_logger('metrics')
+
+class Metrics:
+    """Shared store of counters, gauges and histograms"""
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    PREFIX = 'zendisplay_'
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not isinstance(cls._instance, cls):
+            cls._instance = object.__new__(cls)
+            cls._instance.__init__(initialize=True) # pylint: disable=unnecessary-dunder-call
+        return cls._instance
+
+    def __init__(self, initialize=False):
+        if initialize is True:
+            self.lock = threading.Lock()
+            self.types = {}
+            self.help = {}
+            self.values = {}
+            self.histograms = {}
+            self.collectors = []
+            self.server = None
+
+    def describe(self, name, metric_type, text):
+        """Set the type and help text of a metric"""
+        self.types[name] = metric_type
+        self.help[name] = text
+
+    def count(self, name, value=1, **labels):
+        """Increase a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Set the value of a gauge"""
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        """Add an observation to a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.BUCKETS), 0, 0.0]
+            for index, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += 1
+            histogram[2] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of the block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def add_collector(self, collector):
+        """Add a callable returning (name, labels, value) tuples at render time"""
+        self.collectors.append(collector)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        """Format labels, escaping their values"""
+        items = tuple(labels) + tuple(extra)
+        if not bool(items):
+            return ''
+        escaped = (
+            (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for key, value in items
+        )
+        return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+    def _header(self, lines, name, default_type):
+        """Add the help and type lines of a metric"""
+        if name in self.help:
+            lines.append(f'# HELP {self.PREFIX}{name} {self.help[name]}')
+        lines.append(f'# TYPE {self.PREFIX}{name} {self.types.get(name, default_type)}')
+
+    def _render_histogram(self, lines, name, labels, histogram):
+        """Add the lines of a histogram"""
+        buckets, count, total = histogram
+        metric = f'{self.PREFIX}{name}'
+        for bound, bucket in zip(self.BUCKETS, buckets):
+            lines.append(f'{metric}_bucket{self._labels(labels, (("le", bound),))} {bucket}')
+        lines.append(f'{metric}_bucket{self._labels(labels, (("le", "+Inf"),))} {count}')
+        lines.append(f'{metric}_sum{self._labels(labels)} {total}')
+        lines.append(f'{metric}_count{self._labels(labels)} {count}')
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        with self.lock:
+            values = dict(self.values)
+            histograms = {
+                key: (list(buckets), count, total)
+                for key, (buckets, count, total) in self.histograms.items()
+            }
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                values[(name, tuple(sorted(labels.items())))] = value
+
+        lines = []
+        previous = None
+        for (name, labels), value in sorted(values.items()):
+            if name != previous:
+                self._header(lines, name, 'gauge')
+                previous = name
+            lines.append(f'{self.PREFIX}{name}{self._labels(labels)} {value}')
+
+        for (name, labels), histogram in sorted(histograms.items()):
+            if name != previous:
+                self._header(lines, name, 'histogram')
+                previous = name
+            self._render_histogram(lines, name, labels, histogram)
+
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Write metrics atomically for the node exporter textfile collector"""
+        directory = os.path.dirname(os.path.abspath(path))
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+        try:
+            os.fchmod(file_descriptor, 0o644)
+            with os.fdopen(file_descriptor, 'w', encoding='utf-8') as metrics_file:
+                metrics_file.write(self.render())
+            os.replace(temp_path, path)
+        except OSError as exception:
+            os.unlink(temp_path)
+            LOG.warning('Could not write metrics', path=path, error=exception)
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve metrics over HTTP on a background thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Respond to every GET request with the metrics"""
+            def do_GET(self): # pylint: disable=invalid-name
+                """Send the metrics"""
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_args): # pylint: disable=arguments-differ
+                """Do not log requests"""
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
@@ -0,0 +1,175 @@
+"""Record luminance and brightness history in a fixed size ring file"""
+import os
+import sys
+import csv
+import math
+import mmap
+import time
+import struct
+from collections import namedtuple
+
+Sample = namedtuple(
+    'Sample', ('time', 'luminance', 'display', 'recommended', 'applied', 'correction')
+)
+
+# pylint: disable-next=too-many-instance-attributes
+class Recorder:
+    """Write samples as fixed width records into a memory mapped ring file
+
+    The file holds a header with the position of the next record, a table of display names
+    and a preallocated area of capacity records. Records refer to displays by their index
+    in the table. Once full, the oldest records are overwritten. Brightness values are
+    unsigned bytes, 255 stands for no value.
+    """
+    MAGIC = b'ZDREC003'
+    # Magic, capacity, record size, next record, number of records, number of names
+    HEADER = struct.Struct('<8sIIQQI4x')
+    NAME = struct.Struct('<128s')
+    NAMES = 256
+    NAMES_SIZE = NAMES * NAME.size
+    # Time, luminance, name index, recommended, applied, correction
+    RECORD = struct.Struct('<dfHBBbx')
+    NONE = 255
+
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.names = {}
+        self.head = 0
+        self.count = 0
+        self.name_count = 0
+        self.file = None
+        self.map = None
+        self._open()
+
+    def _open(self):
+        """Map the ring file, creating it if it is missing or has a different layout"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(directory):
+            os.makedirs(directory, mode=0o755)
+
+        size = self.HEADER.size + self.NAMES_SIZE + self.capacity * self.RECORD.size
+        self.file = open(self.path, 'a+b') # pylint: disable=consider-using-with
+        reset = os.fstat(self.file.fileno()).st_size != size
+        if reset:
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+
+        magic, capacity, record_size, head, count, name_count = \
+            self.HEADER.unpack_from(self.map, 0)
+        if reset or magic != self.MAGIC or capacity != self.capacity \
+                or record_size != self.RECORD.size:
+            head, count, name_count = (0, 0, 0)
+        self.head, self.count = (head % self.capacity, min(count, self.capacity))
+        self.name_count = min(name_count, self.NAMES)
+        self.names = {name: index for index, name in enumerate(_names(self.map, self.name_count))}
+        self._write_header()
+
+    def _write_header(self):
+        self.HEADER.pack_into(
+            self.map, 0, self.MAGIC, self.capacity, self.RECORD.size, self.head, self.count,
+            self.name_count,
+        )
+
+    def _name(self, display):
+        """Index of the display name in the table, added on first use
+
+        Once the table is full, displays not in it are recorded without a name.
+        """
+        display = str(display)
+        index = self.names.get(display)
+        if index is None:
+            if self.name_count >= self.NAMES:
+                return self.NAMES
+            index = self.names[display] = self.name_count
+            self.NAME.pack_into(
+                self.map, self.HEADER.size + index * self.NAME.size, display.encode('utf-8')
+            )
+            self.name_count += 1
+        return index
+
+    # pylint: disable-next=too-many-arguments
+    def record(self, luminance, display, recommended=None, applied=None, correction=0):
+        """Overwrite the oldest record with a new sample"""
+        self.RECORD.pack_into(
+            self.map,
+            self.HEADER.size + self.NAMES_SIZE + self.head * self.RECORD.size,
+            time.time(),
+            luminance if luminance is not None else float('nan'),
+            self._name(display),
+            self.NONE if recommended is None else recommended,
+            self.NONE if applied is None else applied,
+            correction,
+        )
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self._write_header()
+
+    def close(self):
+        """Flush and unmap the ring file"""
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+            self.map = None
+
+    @staticmethod
+    def default_path():
+        """Ring file in the state directory of the user"""
+        return os.path.join(
+            os.environ.get('XDG_STATE_HOME', os.path.expanduser('~/.local/state')),
+            'zendisplay',
+            'history.bin',
+        )
+
+
+def _names(data, count):
+    """Decode the first count entries of the name table"""
+    return [
+        Recorder.NAME.unpack_from(data, Recorder.HEADER.size + index * Recorder.NAME.size)[0]
+        .rstrip(b'\0').decode('utf-8', 'replace')
+        for index in range(count)
+    ]
+
+
+def _unpack(data, position, names):
+    """Decode the record at the given position of the ring"""
+    timestamp, luminance, name, recommended, applied, correction = Recorder.RECORD.unpack_from(
+        data, Recorder.HEADER.size + Recorder.NAMES_SIZE + position * Recorder.RECORD.size
+    )
+    return Sample(
+        timestamp,
+        None if math.isnan(luminance) else luminance,
+        names[name] if name < len(names) else '',
+        None if recommended == Recorder.NONE else recommended,
+        None if applied == Recorder.NONE else applied,
+        correction,
+    )
+
+
+def read_samples(path, since=None):
+    """Return the samples of a ring file from the oldest to the newest"""
+    with open(path, 'rb') as ring_file:
+        with mmap.mmap(ring_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, capacity, record_size, head, count, name_count = \
+                Recorder.HEADER.unpack_from(data, 0)
+            if magic != Recorder.MAGIC or record_size != Recorder.RECORD.size:
+                raise ValueError(f'Not a recorder file: {path}')
+
+            names = _names(data, min(name_count, Recorder.NAMES))
+            samples = (
+                _unpack(data, (head - count + index) % capacity, names) for index in range(count)
+            )
+            return [sample for sample in samples if since is None or sample.time >= since]
+
+
+def export_csv(path, output, since=None):
+    """Write the samples of a ring file to a file object as CSV"""
+    writer = csv.writer(output)
+    writer.writerow(Sample._fields)
+    for sample in read_samples(path, since):
+        writer.writerow(('' if value is None else value for value in sample))
+
+
+if __name__ == '__main__':
+    export_csv(sys.argv[1] if len(sys.argv) > 1 else Recorder.default_path(), sys.stdout)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""Sample the ambient light sensors once for every session on the machine
+
+The broker claims and polls the sensors and publishes their readings in a memory mapped
+file. Instances using the 'broker' sensor backend read the file instead of the hardware.
+"""
+import os
+import sys
+import mmap
+import json
+import stat
+import time
+import fcntl
+import struct
+import signal
+import argparse
+import threading
+from collections import namedtuple
+from zendisplay_config import Config
+from backends import BackendRegistry
+from log import get_logger
+
+LOG = get_logger('sensor_broker')
+
+Reading = namedtuple('Reading', ['value', 'updated', 'ready'])
+Snapshot = namedtuple('Snapshot', ['interval', 'published', 'readings'])
+
+class SharedReadings:
+    """Sensor readings in a memory mapped file guarded by a sequence lock
+
+    The writer makes the sequence odd while it updates the file and even when it is done.
+    Readers copy the file and retry if the sequence was odd or changed meanwhile, so they
+    never block the writer or each other. Times are from the system wide monotonic clock.
+    Only a file in a directory nobody else can write to, owned by the owner of the directory,
+    is used, so other users can not put their own readings in its place.
+    """
+    DEFAULT_PATH = '/run/zendisplay/sensors'
+    MAGIC = b'ZDSENS01'
+    # Magic, number of sensors, reserved, sequence, sampling interval, time of the last sample
+    HEADER = struct.Struct('<8sIIQdd')
+    SEQUENCE = struct.Struct('<Q')
+    SEQUENCE_OFFSET = 16
+    # Name, value, time of the reading, ready flag
+    SLOT = struct.Struct('<32sdd?7x')
+    CAPACITY = 16
+    SIZE = HEADER.size + CAPACITY * SLOT.size
+    RETRIES = 10
+    WRITABLE_BY_OTHERS = stat.S_IWGRP | stat.S_IWOTH
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        flags = (os.O_RDWR | os.O_CREAT) if writable else os.O_RDONLY
+        if writable:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o755, exist_ok=True)
+        owner = self._check_directory()
+        self.file_descriptor = os.open(path, flags | os.O_NOFOLLOW | os.O_CLOEXEC, 0o644)
+        try:
+            self._check_file(owner)
+            if writable:
+                self._lock()
+            self.inode = os.fstat(self.file_descriptor).st_ino
+            self.map = mmap.mmap(
+                self.file_descriptor, self.SIZE,
+                prot=mmap.PROT_READ | (mmap.PROT_WRITE if writable else 0),
+            )
+        except (OSError, ValueError):
+            os.close(self.file_descriptor)
+            raise
+        if writable:
+            self.sequence = self._sequence() + self._sequence() % 2
+            return
+        # Readers only need the mapping, the writer keeps the file open for its lock
+        os.close(self.file_descriptor)
+        self.file_descriptor = None
+        if self.map[:len(self.MAGIC)] != self.MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a sensor broker file')
+
+    @classmethod
+    def default_path(cls):
+        """File in the configured place, or in the runtime directory of the broker service"""
+        path = Config().get('broker', 'path')
+        return path if bool(path) else cls.DEFAULT_PATH
+
+    def _check_directory(self):
+        """Refuse a directory other users can create files in, return the expected owner"""
+        directory = os.stat(os.path.dirname(os.path.abspath(self.path)))
+        if directory.st_mode & self.WRITABLE_BY_OTHERS:
+            raise PermissionError(f'{self.path} is in a directory writable by other users')
+        # The writer owns its file, readers expect the owner of the directory
+        return os.geteuid() if self.writable else directory.st_uid
+
+    def _check_file(self, owner):
+        """Refuse a file of another user or one that other users can write to"""
+        status = os.fstat(self.file_descriptor)
+        if not stat.S_ISREG(status.st_mode) or status.st_uid != owner:
+            raise PermissionError(f'{self.path} is not a file owned by user {owner}')
+        if not self.writable and status.st_mode & self.WRITABLE_BY_OTHERS:
+            raise PermissionError(f'{self.path} is writable by other users')
+
+    def _lock(self):
+        """Make sure there is one writer, size the file and let every user read it"""
+        try:
+            fcntl.flock(self.file_descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as exception:
+            raise OSError(f'{self.path} is in use by another broker') from exception
+        os.ftruncate(self.file_descriptor, self.SIZE)
+        os.fchmod(self.file_descriptor, 0o644)
+
+    def _sequence(self):
+        return self.SEQUENCE.unpack_from(self.map, self.SEQUENCE_OFFSET)[0]
+
+    def write(self, interval, readings):
+        """Publish (name, value, updated, ready) tuples"""
+        readings = readings[:self.CAPACITY]
+        self.sequence += 1
+        self.SEQUENCE.pack_into(self.map, self.SEQUENCE_OFFSET, self.sequence)
+        self.HEADER.pack_into(
+            self.map, 0, self.MAGIC, len(readings), 0, self.sequence, interval, time.monotonic(),
+        )
+        for index, (name, value, updated, ready) in enumerate(readings):
+            self.SLOT.pack_into(
+                self.map, self.HEADER.size + index * self.SLOT.size,
+                name.encode('utf-8')[:32], float(value), updated, ready,
+            )
+        # The sequence is written last, readers that copied the file meanwhile retry
+        self.sequence += 1
+        self.SEQUENCE.pack_into(self.map, self.SEQUENCE_OFFSET, self.sequence)
+
+    def read(self):
+        """Consistent copy of the readings, None if the writer kept updating them"""
+        for _ in range(self.RETRIES):
+            before = self._sequence()
+            if before % 2 == 0:
+                data = self.map[:self.SIZE]
+                if self._sequence() == before:
+                    return self._parse(data)
+            time.sleep(0.0001)
+        return None
+
+    def _parse(self, data):
+        _, count, _, _, interval, published = self.HEADER.unpack_from(data)
+        readings = {}
+        for index in range(min(count, self.CAPACITY)):
+            name, value, updated, ready = self.SLOT.unpack_from(
+                data, self.HEADER.size + index * self.SLOT.size
+            )
+            readings[name.rstrip(b'\0').decode('utf-8', 'replace')] = Reading(value, updated, ready)
+        return Snapshot(interval, published, readings)
+
+    def is_replaced(self):
+        """Return whether the file was removed or replaced by a restarted broker"""
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except OSError:
+            return True
+
+    def close(self):
+        """Unmap the file, releasing the writer lock"""
+        self.map.close()
+        if self.file_descriptor is not None:
+            os.close(self.file_descriptor)
+            self.file_descriptor = None
+
+
+class SensorBroker:
+    """Detect every sensor and publish their readings at the sampling interval"""
+    EXCLUDED_BACKENDS = ('broker', 'manual')
+
+    def __init__(self, path=None, interval=None):
+        self.interval = interval if interval is not None else Config().get('broker', 'interval')
+        self.readings = SharedReadings(path or SharedReadings.default_path(), writable=True)
+        self.sensors = []
+        self.stopped = threading.Event()
+
+    def detect(self):
+        """Find the sensors of the configured backends and enable them"""
+        backends = BackendRegistry()
+        for name in backends.parse_list(Config().get('general', 'sensor_backends')):
+            if name in self.EXCLUDED_BACKENDS:
+                continue
+            for sensor in backends.detect(name):
+                sensor.enable()
+                self.sensors.append(sensor)
+                LOG.info('Sensor added', sensor=sensor.name, backend=name)
+
+    def sample(self):
+        """Read every sensor and publish the readings"""
+        now = time.monotonic()
+        readings = []
+        for sensor in self.sensors:
+            value, ready = (0, sensor.is_ready())
+            if ready:
+                try:
+                    value = sensor.get_luminance()
+                except (OSError, ValueError) as exception:
+                    LOG.warning('Sensor read failed', sensor=sensor.name, error=exception)
+                    ready = False
+            age = sensor.get_age()
+            readings.append((sensor.name, value or 0, now - age if age is not None else now, ready))
+        self.readings.write(self.interval, readings)
+        return True
+
+    def run(self):
+        """Sample until stopped, on a GLib main loop if available so DBus sensors get signals"""
+        # pylint: disable=import-outside-toplevel
+        try:
+            from gi.repository import GLib
+            from dbus.mainloop.glib import DBusGMainLoop
+        except ImportError:
+            GLib = None # pylint: disable=invalid-name
+
+        if GLib is not None:
+            DBusGMainLoop(set_as_default=True)
+            loop = GLib.MainLoop()
+            for signal_number in (signal.SIGTERM, signal.SIGINT):
+                GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal_number, loop.quit)
+        else:
+            for signal_number in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signal_number, lambda *_: self.stopped.set())
+
+        self.detect()
+        self.sample()
+        try:
+            if GLib is not None:
+                GLib.timeout_add(round(self.interval * 1000), self.sample)
+                loop.run()
+            else:
+                while not self.stopped.wait(self.interval):
+                    self.sample()
+        finally:
+            # Sessions stop using the sensors instead of reading stale values
+            self.readings.write(self.interval, [])
+            self.readings.close()
+
+
+def main():
+    """Run the broker or print the readings it publishes"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--path', help='file of the readings, defaults to broker.path')
+    parser.add_argument('--interval', type=float, help='seconds between samples')
+    parser.add_argument('--read', action='store_true', help='print the published readings')
+    args = parser.parse_args()
+
+    if not args.read:
+        SensorBroker(args.path, args.interval).run()
+        return 0
+
+    try:
+        readings = SharedReadings(args.path or SharedReadings.default_path())
+    except (OSError, ValueError) as exception:
+        print(exception, file=sys.stderr)
+        return 1
+    snapshot = readings.read()
+    if snapshot is None:
+        return 1
+    age = time.monotonic() - snapshot.published
+    for name, reading in snapshot.readings.items():
+        print(json.dumps({
+            'sensor': name,
+            'value': reading.value,
+            'age': round(time.monotonic() - reading.updated, 3),
+            'ready': reading.ready,
+            'broker_age': round(age, 3),
+        }))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
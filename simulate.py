@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""Replay luminance traces through the controller to tune its parameters offline
+
+Traces are read from recorder files, from CSV files with time and luminance columns or
+generated. Every parameter given more than once is swept, combinations run in parallel.
+"""
+import sys
+import csv
+import math
+import bisect
+import random
+import argparse
+import itertools
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from controller import Controller
+from display_profile import DisplayProfile
+from write_budget import WriteBudget
+from recorder import read_samples
+from log import setup as setup_logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+Result = namedtuple('Result', ('writes', 'time_in_error', 'mean_latency', 'max_latency'))
+
+PARAMETERS = {
+    'slope': float,
+    'base_value': float,
+    'margin': float,
+    'offset': int,
+    'scale': float,
+    'interval': float,
+    'write_rate': int,
+    'write_burst': int,
+}
+
+def load_trace(path):
+    """Return the times and luminance values of a recorder or CSV file"""
+    if not path.endswith('.csv'):
+        samples = [sample for sample in read_samples(path) if sample.luminance is not None]
+        display = samples[0].display if bool(samples) else None
+        samples = [sample for sample in samples if sample.display == display]
+        return ([sample.time for sample in samples], [sample.luminance for sample in samples])
+
+    with open(path, newline='', encoding='utf-8') as csv_file:
+        rows = [row for row in csv.DictReader(csv_file) if bool(row.get('luminance'))]
+    return ([float(row['time']) for row in rows], [float(row['luminance']) for row in rows])
+
+
+def synthetic_trace(hours=24.0, rate=10.0, peak=1000.0, seed=0):
+    """Daylight curve with passing clouds and sensor noise"""
+    generator = random.Random(seed)
+    count = int(hours * 3600 * rate)
+    times = [index / rate for index in range(count)]
+    luminance = []
+    cloud = 1.0
+    for time in times:
+        daylight = max(math.sin(math.pi * (time / 3600 % 24 - 6) / 12), 0)
+        if generator.random() < 1 / (rate * 600):
+            cloud = generator.uniform(0.2, 1.0)
+        luminance.append(max(peak * daylight * cloud + 5 + generator.gauss(0, 2), 0))
+    return (times, luminance)
+
+
+def resample(times, luminance, interval):
+    """Luminance seen by the control loop when it runs every interval seconds"""
+    if not bool(times):
+        return []
+    count = int((times[-1] - times[0]) / interval) + 1
+    if np is not None:
+        ticks = times[0] + np.arange(count) * interval
+        indices = np.searchsorted(np.asarray(times), ticks, side='right') - 1
+        return np.asarray(luminance, dtype=float)[indices]
+    return [
+        luminance[bisect.bisect_right(times, times[0] + index * interval) - 1]
+        for index in range(count)
+    ]
+
+
+def _controller(params):
+    """Controller and display profile configured with the simulated parameters"""
+    controller = Controller()
+    controller.line_m = params.get('slope', controller.line_m)
+    controller.line_b = params.get('base_value', controller.line_b)
+    controller.brightness_margin = params.get('margin', controller.brightness_margin)
+    profile = DisplayProfile(
+        'simulated',
+        offset=params.get('offset', 0),
+        scale=params.get('scale', 1.0),
+        interval=params.get('interval', 1.0),
+    )
+    return (controller, profile)
+
+
+def _targets(luminance, controller, profile):
+    """Brightness recommended for every tick"""
+    if np is None:
+        return [profile.apply(controller.calculate_brightness(value)) for value in luminance]
+
+    luminance = np.asarray(luminance, dtype=float)
+    value = controller.line_m * luminance + controller.line_b
+    curve = controller.curve
+    if curve is not None and not controller.learning_paused:
+        bins = [index for index, weight in enumerate(curve.weights) if weight >= curve.MIN_WEIGHT]
+        if bool(bins):
+            position = np.minimum(np.log2(1 + np.maximum(luminance, 0)), curve.BINS - 1)
+            value += np.interp(position, bins, [curve.offsets[index] for index in bins])
+    common = np.clip(np.round(value), 0, 100)
+    return np.clip(np.round(common * profile.scale + profile.offset), 0, 100).astype(int)
+
+
+def _next_write(targets, start, current, margin):
+    """Index of the next tick at which the controller changes the brightness"""
+    if np is None:
+        for index in range(start, len(targets)):
+            target = targets[index]
+            if target != current and (target in (0, 100) or abs(target - current) >= margin):
+                return index
+        return None
+
+    chunk = 256
+    while start < len(targets):
+        window = targets[start:start + chunk]
+        mask = (window != current) & (
+            (window == 0) | (window == 100) | (np.abs(window - current) >= margin)
+        )
+        if mask.any():
+            return start + int(mask.argmax())
+        start += chunk
+        chunk *= 2
+    return None
+
+
+def _replay_fast(targets, margin, initial):
+    """Applied brightness of every tick without a write budget"""
+    applied = []
+    current, start = (initial, 0)
+    while True:
+        index = _next_write(targets, start, current, margin)
+        end = len(targets) if index is None else index
+        applied.append((end - start, current))
+        if index is None:
+            break
+        current, start = (int(targets[index]), index)
+    if np is not None:
+        return np.repeat([value for _, value in applied], [length for length, _ in applied])
+    return [value for length, value in applied for _ in range(length)]
+
+
+def _replay_reference(luminance, controller, profile, params, initial):
+    """Applied and recommended brightness of every tick, running the controller directly"""
+    now = [0.0]
+    profile.budget = WriteBudget(
+        params.get('write_rate', 0), params.get('write_burst', 10), clock=lambda: now[0],
+    )
+    applied, targets = ([], [])
+    current = initial
+    for index, value in enumerate(luminance):
+        now[0] = index * profile.interval
+        target = controller.recommend_brightness(value, current, profile)
+        if target is not None:
+            current = target
+            profile.budget.consume()
+        applied.append(current)
+        targets.append(controller.recommended)
+    return (applied, targets)
+
+
+def _evaluate(applied, targets, interval, tolerance):
+    """Count writes and measure how long the brightness is off by more than the tolerance"""
+    runs, run, writes, previous = ([], 0, 0, None)
+    for index, value in enumerate(applied):
+        if index > 0 and value != previous:
+            writes += 1
+        previous = value
+        if abs(value - targets[index]) > tolerance:
+            run += 1
+        elif run > 0:
+            runs.append(run)
+            run = 0
+    if run > 0:
+        runs.append(run)
+    return Result(
+        writes,
+        sum(runs) * interval,
+        sum(runs) * interval / len(runs) if bool(runs) else 0.0,
+        max(runs, default=0) * interval,
+    )
+
+
+def _evaluate_vectorized(applied, targets, interval, tolerance):
+    """Vectorized version of _evaluate"""
+    error = np.concatenate(([0], (np.abs(applied - targets) > tolerance).astype(int), [0]))
+    edges = np.diff(error)
+    runs = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+    return Result(
+        int(np.count_nonzero(np.diff(applied))),
+        float(runs.sum() * interval),
+        float(runs.mean() * interval) if bool(len(runs)) else 0.0,
+        float(runs.max(initial=0) * interval),
+    )
+
+
+def simulate(luminance, params, tolerance=2, initial=50):
+    """Replay luminance sampled every interval seconds with the given parameters
+
+    Without a write budget the recommendations are evaluated for the whole trace at once,
+    a budget depends on the timing of earlier writes so the controller runs tick by tick.
+    """
+    controller, profile = _controller(params)
+    if params.get('write_rate', 0) > 0:
+        applied, targets = _replay_reference(luminance, controller, profile, params, initial)
+        if np is not None:
+            applied, targets = (np.asarray(applied), np.asarray(targets))
+    else:
+        targets = _targets(luminance, controller, profile)
+        applied = _replay_fast(targets, profile.get_margin(controller.brightness_margin), initial)
+
+    evaluate = _evaluate if np is None else _evaluate_vectorized
+    return evaluate(applied, targets, profile.interval, tolerance)
+
+
+_TRACE = {}
+
+def _init_worker(times, luminance, tolerance):
+    """Keep the trace in the worker process, it is sent once instead of with every task"""
+    setup_logging('warning')
+    _TRACE.update(times=times, luminance=luminance, tolerance=tolerance)
+
+
+def _run(params):
+    luminance = resample(_TRACE['times'], _TRACE['luminance'], params.get('interval', 1.0))
+    return (params, simulate(luminance, params, _TRACE['tolerance']))
+
+
+def sweep(times, luminance, grid, tolerance=2, processes=None):
+    """Simulate every combination of the parameter values in grid in parallel"""
+    names = list(grid)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+    with ProcessPoolExecutor(processes, initializer=_init_worker,
+                             initargs=(times, luminance, tolerance)) as executor:
+        return list(executor.map(_run, combinations, chunksize=max(len(combinations) // 64, 1)))
+
+
+def main():
+    """Run the simulation from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('trace', nargs='?', help='recorder or CSV file, synthetic if missing')
+    parser.add_argument('--hours', type=float, default=24.0, help='length of synthetic trace')
+    parser.add_argument('--rate', type=float, default=10.0, help='samples per second if synthetic')
+    parser.add_argument('--tolerance', type=float, default=2, help='allowed brightness error')
+    parser.add_argument('--processes', type=int, default=None, help='parallel simulations')
+    for name, value_type in PARAMETERS.items():
+        parser.add_argument(f'--{name.replace("_", "-")}', type=value_type, nargs='+')
+    args = parser.parse_args()
+
+    setup_logging('warning')
+    times, luminance = load_trace(args.trace) if args.trace else \
+        synthetic_trace(args.hours, args.rate)
+    grid = {name: getattr(args, name) for name in PARAMETERS if getattr(args, name) is not None}
+
+    if all(len(values) == 1 for values in grid.values()):
+        results = [_run_single(times, luminance, grid, args.tolerance)]
+    else:
+        results = sweep(times, luminance, grid, args.tolerance, args.processes)
+
+    writer = csv.writer(sys.stdout, delimiter='\t')
+    writer.writerow(list(grid) + list(Result._fields))
+    for params, result in sorted(results, key=lambda item: (item[1].writes, item[1].time_in_error)):
+        writer.writerow([params[name] for name in grid] + [f'{value:g}' for value in result])
+
+
+def _run_single(times, luminance, grid, tolerance):
+    """Simulate one set of parameters in this process"""
+    params = {name: values[0] for name, values in grid.items()}
+    sampled = resample(times, luminance, params.get('interval', 1.0))
+    return (params, simulate(sampled, params, tolerance))
+
+
+if __name__ == '__main__':
+    main()
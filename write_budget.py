@@ -0,0 +1,64 @@
+"""Limit the rate of writes to a display"""
+import time
+
+class WriteBudget:
+    """Token bucket with a sustained write rate per hour and a burst size
+
+    The clock returning the current time can be replaced to run on simulated time.
+    """
+    def __init__(self, rate=0, burst=10, step_factor=3.0, clock=time.monotonic):
+        self.clock = clock
+        self.rate = rate / 3600
+        self.burst = max(burst, 1)
+        self.step_factor = step_factor
+        self.tokens = float(self.burst)
+        self.updated = self.clock()
+        self.counters = {
+            'since': time.time(),
+            'writes': 0,
+            'forced_writes': 0,
+            'deferred': 0,
+        }
+
+    def configure(self, rate=0, burst=10, step_factor=3.0):
+        """Change the limits, keeping the tokens available"""
+        self._refill()
+        self.rate = rate / 3600
+        self.burst = max(burst, 1)
+        self.step_factor = step_factor
+        self.tokens = min(self.tokens, self.burst)
+
+    def is_limited(self):
+        """Return whether the writes are limited at all"""
+        return self.rate > 0
+
+    def _refill(self):
+        """Add the tokens accumulated since the last update"""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def scale_margin(self, margin):
+        """Require larger steps as the budget runs short"""
+        if not self.is_limited():
+            return margin
+        self._refill()
+        shortage = 1 - min(self.tokens, self.burst) / self.burst
+        return margin * (1 + shortage * (self.step_factor - 1))
+
+    def allows(self):
+        """Return whether a write fits in the budget, count it as deferred otherwise"""
+        if not self.is_limited():
+            return True
+        self._refill()
+        if self.tokens >= 1:
+            return True
+        self.counters['deferred'] += 1
+        return False
+
+    def consume(self, forced=False):
+        """Account for a write, forced writes are allowed even without budget"""
+        self.counters['forced_writes' if forced else 'writes'] += 1
+        if self.is_limited():
+            self._refill()
+            self.tokens = max(self.tokens - 1, 0)
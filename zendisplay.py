@@ -6,14 +6,19 @@ from zendisplay_config import Config
 def _get_gui_type():
     """Detect the GUI type to use"""
     config = Config().get('general', 'gui')
-    if config in ('gtk', 'qt'):
+    if config in ('gtk', 'qt', 'headless'):
         return config
+    if not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY"):
+        return 'headless'
     if os.environ.get("DESKTOP_SESSION") in ("ubuntu", "cinnamon"):
         return 'gtk'
     return 'qt'
 
-if _get_gui_type() == 'gtk':
-    from zendisplay_gtk import ZenDisplay
+GUI_TYPE = _get_gui_type()
+if GUI_TYPE == 'headless':
+    from zendisplay_headless import ZenDisplay
+elif GUI_TYPE == 'gtk':
+    from zendisplay_gtk import ZenDisplay # type: ignore[misc]
 else:
     from zendisplay_qt import ZenDisplay # type: ignore[misc]
 
@@ -1,26 +1,56 @@
 """Small script to adjust display brightness according to ambient lighting"""
 import sys
+import time
+from contextlib import contextmanager
 from zendisplay_config import Config
 from controller import Controller
 from displays import DisplayManager
-from display_dbus import DisplayDBus
-from display_ddcutil import DisplayDDCUtil
 from luminance_sources import LuminanceSourceManager
-from luminance_dbus import LuminanceDBus
-from luminance_iio import LuminanceIIO
-from luminance_manual import LuminanceManual
-from luminance_mqtt import LuminanceMQTT
+from backends import BackendRegistry
 from condition_checker import ConditionChecker
+from config_watcher import ConfigWatcher
+from control_api import ControlApi
+from metrics import Metrics
+from recorder import Recorder
+from log import get_logger, setup as setup_logging, Trace
 
+LOG = get_logger('main')
+
+# pylint: disable-next=too-many-instance-attributes
 class ZenDisplay:
     """Automatic display brightness controller"""
     def __init__(self):
+        self.logging = None
+        self.configure(Config().snapshot())
+        Config().subscribe(self.configure, ('general', 'logging'))
+        self.trace = None
+
         self._init_framework()
 
+        self.config_watcher = None
+        if Config().get('general', 'watch_config') is True:
+            self.config_watcher = ConfigWatcher(Config().get_config_file_paths())
+
+        self.force_update = False
+        self.backends = BackendRegistry()
         self.controller = Controller()
-        self.displays = self._init_displays()
-        self.sensors = self._init_sensors()
+        self.recorder = self._init_recorder()
+        self.displays = DisplayManager()
+        self.sensors = LuminanceSourceManager()
+        self.manual_sensor = None
+        self.pending_sensor = None
+        # Learned corrections do not apply in manual mode or while a condition overrides
+        self.manual_mode = False
+        self.condition_override = False
+        # Sensors found by each configured backend, None until the backend reported
+        self.sensor_slots = []
+        self._init_devices()
         self.condition_checker = self._init_condition_checker()
+        self.backends.report()
+        self.api = self._init_api()
+        self.intercept = self.controller.line_b
+        Config().subscribe(self._intercept_changed, ('brightness',))
+        self._init_metrics()
 
     def run(self):
         """Run main loop"""
@@ -31,65 +61,298 @@ class ZenDisplay:
     def _brightness_updated(self, brightness):
         """Run when brightness is updated"""
 
+    def call_soon(self, callback):
+        """Run callback on the main loop, safe to call from any thread"""
+        callback()
+
+    def _init_metrics(self):
+        """Start the metrics endpoint if configured"""
+        Metrics().describe('tick_seconds', 'histogram', 'Duration of control ticks')
+        Metrics().describe('tick_phase_seconds', 'histogram', 'Duration of control tick phases')
+        Metrics().describe('backend_io_seconds', 'histogram', 'Duration of device I/O')
+        Metrics().describe('backend_errors_total', 'counter', 'Failed device I/O operations')
+        Metrics().describe('ddcutil_calls_total', 'counter', 'Invocations of ddcutil')
+        Metrics().describe('ddc_sleep_multiplier', 'gauge', 'Learned DDC/CI delay multiplier')
+        Metrics().describe('bus_lock_contended_total', 'counter', 'Bus locks held by others')
+        Metrics().describe('bus_lock_busy_total', 'counter', 'Transfers skipped on a busy bus')
+        Metrics().describe('mqtt_publish_total', 'counter', 'Messages published to MQTT')
+        Metrics().describe(
+            'mqtt_publish_skipped_total', 'counter', 'Values held back or dropped by throttling'
+        )
+        Metrics().describe('mqtt_invalid_messages_total', 'counter', 'Unreadable MQTT messages')
+        Metrics().describe('mqtt_connect_failures_total', 'counter', 'Failed MQTT connections')
+        Metrics().describe('mqtt_sensors', 'gauge', 'MQTT topics with a recent reading')
+        Metrics().describe('sensor_age_seconds', 'gauge', 'Age of the active sensor reading')
+        for counter in ('writes', 'forced_writes', 'deferred'):
+            Metrics().describe(
+                f'display_{counter}_total', 'counter', f'Display {counter.replace("_", " ")}'
+            )
+        port = Config().get('metrics', 'port')
+        if port > 0:
+            try:
+                Metrics().serve(port)
+            except OSError as exception:
+                LOG.error('Could not start metrics endpoint', port=port, error=exception)
+        self.metrics_exported = None
+
+    def _export_metrics(self):
+        """Write the metrics textfile if configured and due"""
+        path = Config().get('metrics', 'textfile')
+        if not bool(path):
+            return
+        now = time.monotonic()
+        if self.metrics_exported is not None and \
+                now - self.metrics_exported < Config().get('metrics', 'textfile_interval'):
+            return
+        self.metrics_exported = now
+        Metrics().write_textfile(path)
+
     @staticmethod
-    def _init_displays():
-        displays = DisplayManager()
-        displays.add_displays_type(DisplayDDCUtil)
-        displays.add_displays_type(DisplayDBus)
+    def _init_recorder():
+        """Open the history ring file if recording is enabled"""
+        if Config().get('recorder', 'enabled') is not True:
+            return None
+        path = Config().get('recorder', 'path') or Recorder.default_path()
+        try:
+            return Recorder(path, max(Config().get('recorder', 'capacity'), 1))
+        except (OSError, ValueError) as exception:
+            LOG.error('Could not open recorder file', path=path, error=exception)
+            return None
 
-        if Config().get('mqtt', 'publish') is True:
-            displays.add_displays_type(LuminanceMQTT)
+    # pylint: disable-next=too-many-arguments
+    def _record(self, luminance, display, recommended=None, applied=None, correction=0):
+        """Add a sample to the history if recording is enabled"""
+        if self.recorder is not None:
+            self.recorder.record(luminance, display, recommended, applied, correction)
 
-        if len(displays) == 0:
-            print('Could not find supported displays')
-            sys.exit()
+    def _init_api(self):
+        if Config().get('api', 'enabled') is not True:
+            return None
+        try:
+            return ControlApi(self)
+        except OSError as exception:
+            LOG.error('Could not start control socket', error=exception)
+            return None
 
-        return displays
+    def _publish(self, event, **data):
+        """Push an event to API subscribers"""
+        if self.api is not None:
+            self.api.publish(event, **data)
 
-    def _init_sensors(self):
-        sensors = LuminanceSourceManager()
-        sensors.add_source_type(LuminanceDBus)
-        sensors.add_source_type(LuminanceIIO)
+    def _intercept_changed(self, config):
+        """Push every change of the intercept, whichever path made it"""
+        if config.brightness.base_value == self.intercept:
+            return
+        self.intercept = config.brightness.base_value
+        self._publish('intercept', value=self.intercept)
 
-        if Config().get('mqtt', 'subscribe') is True:
-            sensors.add_source_type(LuminanceMQTT)
+    def configure(self, config):
+        """Apply general settings from a configuration snapshot"""
+        autosave = config.general.autosave_delay if config.general.autosave else None
+        Config().set_autosave(autosave)
+        if config.logging == self.logging:
+            return
+        self.logging = config.logging
+        setup_logging(
+            config.logging.level,
+            config.logging.rate_limit_interval,
+            config.logging.rate_limit_burst,
+        )
 
-        sensors.add_source_type(LuminanceManual, {
-            'cb_enable': lambda: self.controller.set_intercept(self.displays.get_brightness()),
-            'cb_disable': self.controller.set_intercept,
+    def _init_devices(self):
+        """Detect displays and sensors, late detections are added as they finish"""
+        display_backends = self.backends.parse_list(Config().get('general', 'display_backends'))
+        if Config().get('mqtt', 'publish') is True and 'mqtt' not in display_backends:
+            display_backends.append('mqtt')
+        sensor_backends = self.backends.parse_list(Config().get('general', 'sensor_backends'))
+        if Config().get('mqtt', 'subscribe') is True and 'mqtt' not in sensor_backends:
+            sensor_backends.append('mqtt')
+
+        self.sensor_slots = [None] * len(sensor_backends)
+        self.backends.detect_concurrently(
+            [(backend, None, self._add_displays) for backend in display_backends] +
+            [
+                (backend, None, lambda sensors, slot=slot: self._add_sensors(slot, sensors))
+                for slot, backend in enumerate(sensor_backends)
+            ],
+            Config().get('general', 'detect_timeout'),
+        )
+
+        if len(self.displays) == 0 and not self.backends.is_detecting():
+            LOG.error('Could not find supported displays')
+            sys.exit()
+
+        for sensor in self.backends.detect('manual', {
+            'cb_enable': lambda: self._set_manual_mode(True, self.displays.get_brightness()),
+            'cb_disable': lambda value: self._set_manual_mode(False, value),
             'get_value': lambda: self.controller.line_b,
-        })
+        }):
+            self.manual_sensor = sensor
+            self.sensors.add_source(sensor)
+
+        self.pending_sensor = Config().get('general', 'default_sensor')
+        self._activate_pending_sensor()
+
+    def _add_displays(self, displays):
+        """Add detected displays"""
+        for display in displays:
+            self.displays.add_display(display)
+        self._activate_pending_sensor()
+
+    def _add_sensors(self, slot, sensors):
+        """Add detected sensors after those of the backends configured before them"""
+        index = sum(count for count in self.sensor_slots[:slot] if count is not None)
+        for offset, sensor in enumerate(sensors):
+            self.sensors.add_source(sensor, index + offset)
+        self.sensor_slots[slot] = len(sensors)
+        self._activate_pending_sensor()
 
-        sensors.activate(Config().get('general', 'default_sensor'))
+    def _activate_pending_sensor(self):
+        """Activate the default sensor once every backend configured up to it reported
 
-        return sensors
+        The manual source is used meanwhile, once there are displays to take the brightness
+        from.
+        """
+        if self.pending_sensor is None or self.manual_sensor is None:
+            return
+        reported = 0
+        for count in self.sensor_slots:
+            if count is None:
+                break
+            reported += count
+        if self.pending_sensor < reported or not self.backends.is_detecting():
+            if self.pending_sensor < len(self.sensors):
+                self.sensors.activate(self.pending_sensor)
+            else:
+                self.sensors.activate(self.manual_sensor.uid)
+            self.pending_sensor = None
+        elif len(self.displays) > 0:
+            self.sensors.activate(self.manual_sensor.uid)
+
+    def _devices_changed(self):
+        """Run when displays or sensors are added after startup"""
+
+    def _set_manual_mode(self, enabled, intercept):
+        """Learned corrections do not apply while brightness is set manually"""
+        self.manual_mode = enabled
+        self.controller.set_learning_paused(self.manual_mode or self.condition_override)
+        # No display may have reported its brightness yet
+        if intercept is not None:
+            self.controller.set_intercept(intercept)
+        self.force_update = True
+
+    def set_intercept(self, value):
+        """Set the intercept on user request"""
+        self.controller.set_intercept(value)
+        self._apply_user_change()
+
+    def set_brightness(self, value):
+        """Move the intercept so the current luminance results in the given brightness"""
+        self.set_intercept(self.controller.intercept_for(value))
+
+    def increase_intercept(self):
+        """Increase the brightness on user request"""
+        return self._adjust_intercept(self.controller.increase_intercept)
+
+    def decrease_intercept(self):
+        """Decrease the brightness on user request"""
+        return self._adjust_intercept(self.controller.decrease_intercept)
+
+    def _adjust_intercept(self, adjust):
+        """Apply a user adjustment, recording how much it changed the brightness
+
+        The change is less than the increment at the limits and while a learned correction
+        is averaged with earlier ones.
+        """
+        luminance = self.controller.luminance
+        before = self.controller.calculate_brightness(luminance or 0)
+        value = adjust()
+        after = self.controller.calculate_brightness(luminance or 0)
+        self._record(luminance, '*', correction=after - before)
+        self._apply_user_change()
+        return value
+
+    def _apply_user_change(self):
+        """Apply a user change right away, regardless of schedule and write budget"""
+        self.force_update = True
+        if self._is_ready():
+            self._update_displays()
 
     def _init_condition_checker(self):
         condition_checker = ConditionChecker(
             lambda: self.controller.line_b,
-            self.controller.set_intercept,
+            self.set_intercept,
+            cb_override=self._set_condition_override,
         )
         condition_checker.set_enabled(Config().get('conditions', 'enabled'))
         return condition_checker
 
+    def _set_condition_override(self, active):
+        """The intercept set by a condition gives the brightness without learned corrections"""
+        self.condition_override = active
+        self.controller.set_learning_paused(self.manual_mode or self.condition_override)
+
     def _is_ready(self):
         return self.sensors.is_ready() and self.displays.is_ready()
 
     def main_control(self):
         """Main control function, sets display brightness dynamically"""
+        self.trace = Trace() if Config().snapshot().logging.trace is True else None
+        with Metrics().timer('tick_seconds'):
+            self._control()
+        if self.trace is not None:
+            LOG.debug('Tick trace', ratelimit=False, **self.trace.fields())
+            self.trace = None
+        self._export_metrics()
+        return True
+
+    @contextmanager
+    def _phase(self, name):
+        """Measure a phase of the control tick"""
+        with Metrics().timer('tick_phase_seconds', phase=name):
+            if self.trace is None:
+                yield
+                return
+            with self.trace.span(name):
+                yield
+
+    def _control(self):
+        """Run the phases of a control tick"""
+        if self.config_watcher is not None and self.config_watcher.poll():
+            LOG.info('Configuration changed, reloading')
+            Config().reload()
+
+        if self.backends.is_detecting() and self.backends.poll_late():
+            self.backends.report()
+            self._devices_changed()
+
         if not self._is_ready():
-            return True
+            return
 
-        self.condition_checker.run()
+        with self._phase('condition_check'):
+            self.condition_checker.run()
+        self._update_displays()
 
-        recommended_brightness = self.controller.recommend_brightness(
-            self.sensors.get_luminance(),
-            self.displays.get_brightness(),
-        )
+    def _update_displays(self):
+        """Set displays to the recommended brightness"""
+        force, self.force_update = (self.force_update, False)
+        with self._phase('sensor_read'):
+            luminance = self.sensors.get_luminance()
+        age = self.sensors[self.sensors.get_active()].get_age()
+        if age is not None:
+            Metrics().set_gauge('sensor_age_seconds', round(age, 3))
+        Metrics().set_gauge('luminance', luminance)
 
-        if recommended_brightness is None:
-            return True
+        def recommend(brightness, profile):
+            with self._phase('recommend'):
+                target = self.controller.recommend_brightness(luminance, brightness, profile, force)
+            # The display keeps its brightness when there is no target
+            applied = brightness if target is None else target
+            self._record(luminance, profile.name, self.controller.recommended, applied)
+            return target
+        with self._phase('update_displays'):
+            targets = self.displays.update_brightness(recommend, force)
 
-        self.displays.set_brightness(recommended_brightness)
-        self._brightness_updated(recommended_brightness)
-        return True
+        if bool(targets):
+            self._brightness_updated(next(iter(targets.values())))
+            self._publish('brightness', luminance=luminance, displays=targets)
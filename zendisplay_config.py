@@ -14,6 +14,19 @@ class Config(ConfigBase):
                 'default_sensor': 0,
                 'show_notifications': False,
                 'gui': 'default',
+                'autosave': False,
+                'autosave_delay': 5.0,
+                'watch_config': True,
+                'display_backends': 'ddcutil,dbus',
+                'sensor_backends': 'iio-sensor-proxy,iio',
+                'detect_timeout': 2.0,
+                'ddcutil_path': 'ddcutil',
+                'i2c_path': '/dev',
+                'bus_locking': True,
+                'bus_lock_path': '',
+                'bus_lock_timeout': 0.1,
+                'iio_path': '/sys/bus/iio/devices/',
+                'vendor_light_scale': 1.0,
             },
             'brightness': {
                 'increment': 5,
@@ -21,11 +34,64 @@ class Config(ConfigBase):
                 'slope': 0.2,
                 'base_value': 0,
             },
+            'display': {
+                'offset': 0,
+                'scale': 1.0,
+                'margin': -1,
+                'interval': 1.0,
+                'write_rate': 0,
+                'write_burst': 10,
+                'write_step_factor': 3.0,
+                'sleep_multiplier': 1.0,
+                'adaptive_timing': True,
+            },
+            'learning': {
+                'enabled': False,
+                'decay': 0.5,
+                'bins': '',
+            },
             'mqtt': {
                 'subscribe': False,
                 'publish': False,
                 'host': 'mqtt.example.com',
+                'port': 1883,
+                'keepalive': 60,
+                'tls': False,
+                'tls_ca_certs': '',
+                'reconnect_min_delay': 1,
+                'reconnect_max_delay': 120,
+                'qos': 0,
+                'retain': False,
+                'payload': 'plain',
+                'publish_interval': 0.0,
+                'publish_deadband': 0,
                 'topic': 'zendisplay/brightness',
+                'aggregate': 'median',
+                'stale_after': 300.0,
+            },
+            'api': {
+                'enabled': False,
+                'path': '',
+            },
+            'logging': {
+                'level': 'info',
+                'rate_limit_interval': 60.0,
+                'rate_limit_burst': 5,
+                'trace': False,
+            },
+            'metrics': {
+                'port': 0,
+                'textfile': '',
+                'textfile_interval': 15.0,
+            },
+            'recorder': {
+                'enabled': False,
+                'path': '',
+                'capacity': 100000,
+            },
+            'broker': {
+                'interval': 1.0,
+                'path': '',
             },
             'conditions': {
                 'enabled': False,
@@ -32,10 +32,22 @@ class ZenDisplay(ZenDisplayBase):
         DBusGMainLoop(set_as_default=True)
         GLib.timeout_add(1000, self.main_control)
 
+    def call_soon(self, callback):
+        """Run callback on the main loop, safe to call from any thread"""
+        def run():
+            callback()
+            return GLib.SOURCE_REMOVE
+        GLib.idle_add(run)
+
     def _brightness_updated(self, brightness):
         """Run when brightness is updated"""
         self.indicator.set_title('Brightness: ' + str(brightness) + '%')
 
+    def _devices_changed(self):
+        """Rebuild the menu when devices are added"""
+        self.menu = self.construct_menu()
+        self.indicator.set_menu(self.menu)
+
     @staticmethod
     def _create_indicator():
         indicator = appindicator.Indicator.new(
@@ -139,18 +151,19 @@ class ZenDisplay(ZenDisplayBase):
         brightness_menu_action.show()
         parent.append(brightness_menu_action)
 
+        base_value = Config().snapshot().brightness.base_value
         for value in range(0, 101, 10):
             action = gtk.RadioMenuItem(label=str(value) + "%")
             action.join_group((brightness_menu.get_children()[:1] or [None])[0])
-            if value == Config().get('brightness', 'base_value'):
+            if value == base_value:
                 action.set_active(True)
-            action.connect('activate', lambda _, value=value: self.controller.set_intercept(value))
+            action.connect('activate', lambda _, value=value: self.set_intercept(value))
             action.show()
             brightness_menu.append(action)
 
     def _scroll_event(self, _1, _2, direction):
         """Event handler for the scroll_event signal"""
         if direction == 0:
-            self.controller.increase_intercept()
+            self.increase_intercept()
         elif direction == 1:
-            self.controller.decrease_intercept()
+            self.decrease_intercept()
@@ -0,0 +1,55 @@
+"""Adjust display brightness according to ambient lighting without a user interface"""
+# pylint: disable=wrong-import-position,wrong-import-order
+import signal
+import gi
+from dbus.mainloop.glib import DBusGMainLoop
+from zendisplay_base import ZenDisplay as ZenDisplayBase
+from zendisplay_config import Config
+from log import get_logger
+
+gi.require_version('GLib', '2.0')
+from gi.repository import GLib
+
+LOG = get_logger('headless')
+
+class ZenDisplay(ZenDisplayBase):
+    """Brightness controller running on a plain GLib main loop"""
+    def __init__(self):
+        ZenDisplayBase.__init__(self)
+        self._brightness_updated(self.displays.get_brightness())
+
+    def run(self):
+        """Run main loop until a termination signal arrives"""
+        GLib.timeout_add(1000, self.main_control)
+        self.loop.run()
+
+    def _init_framework(self):
+        """Initialize the main loop"""
+        DBusGMainLoop(set_as_default=True)
+        self.loop = GLib.MainLoop()
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal_number, self.quit)
+        GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGHUP, self._reload)
+
+    def call_soon(self, callback):
+        """Run callback on the main loop, safe to call from any thread"""
+        def run():
+            callback()
+            return GLib.SOURCE_REMOVE
+        GLib.idle_add(run)
+
+    def _brightness_updated(self, brightness):
+        """Run when brightness is updated"""
+        LOG.debug('Brightness updated', brightness=brightness)
+
+    def quit(self):
+        """Stop the main loop"""
+        LOG.info('Stopping')
+        self.loop.quit()
+        return GLib.SOURCE_REMOVE
+
+    @staticmethod
+    def _reload():
+        """Reload the configuration on SIGHUP"""
+        Config().reload()
+        return GLib.SOURCE_CONTINUE
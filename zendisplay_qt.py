@@ -8,6 +8,21 @@ from dbus.mainloop.pyqt5 import DBusQtMainLoop
 from zendisplay_base import ZenDisplay as ZenDisplayBase
 from zendisplay_config import Config
 
+# pylint: disable-next=too-few-public-methods
+class MainLoopCaller(QtCore.QObject):
+    """Run callbacks on the thread of the Qt main loop"""
+    call = QtCore.pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.call.connect(self.run)
+
+    @QtCore.pyqtSlot(object)
+    def run(self, callback):
+        """Run a callback received through the signal"""
+        callback()
+
+
 class ZenDisplay(ZenDisplayBase, QtWidgets.QSystemTrayIcon):
     """System tray icon class"""
     def __init__(self):
@@ -34,11 +49,21 @@ class ZenDisplay(ZenDisplayBase, QtWidgets.QSystemTrayIcon):
         DBusQtMainLoop(set_as_default=True)
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.main_control)
+        self.main_loop_caller = MainLoopCaller()
+
+    def call_soon(self, callback):
+        """Run callback on the main loop, safe to call from any thread"""
+        self.main_loop_caller.call.emit(callback)
 
     def _brightness_updated(self, brightness):
         """Run when brightness is updated"""
         self.setToolTip('Brightness: ' + str(brightness) + '%')
 
+    def _devices_changed(self):
+        """Rebuild the menu when devices are added"""
+        self.menu = self.construct_menu()
+        self.setContextMenu(self.menu)
+
     def toggle_menu(self):
         """Toggle context menu visibility"""
         if self.menu_visible:
@@ -91,12 +116,13 @@ class ZenDisplay(ZenDisplayBase, QtWidgets.QSystemTrayIcon):
         """Create submenu for the brightness setting"""
         brightness_menu = parent.addMenu('Brightness')
         brightness_group = QtWidgets.QActionGroup(brightness_menu)
+        base_value = Config().snapshot().brightness.base_value
         for value in range(0, 101, 10):
             action = brightness_menu.addAction(str(value) + "%")
             action.setCheckable(True)
-            if value == Config().get('brightness', 'base_value'):
+            if value == base_value:
                 action.setChecked(True)
-            action.triggered.connect(lambda _, value=value: self.controller.set_intercept(value))
+            action.triggered.connect(lambda _, value=value: self.set_intercept(value))
             brightness_group.addAction(action)
 
     def _construct_menu_condition_checker(self, parent):
@@ -111,10 +137,10 @@ class ZenDisplay(ZenDisplayBase, QtWidgets.QSystemTrayIcon):
         if event.type() == QtCore.QEvent.Wheel:
             new_value = None
             if event.angleDelta().y() < 0:
-                new_value = self.controller.decrease_intercept()
+                new_value = self.decrease_intercept()
             else:
-                new_value = self.controller.increase_intercept()
-            show_notification = Config().get('general', 'show_notifications')
+                new_value = self.increase_intercept()
+            show_notification = Config().snapshot().general.show_notifications
             if new_value is not None and self.supportsMessages() and show_notification:
                 self.showMessage('Brightness', str(new_value) + '%', msecs=500)
             return True